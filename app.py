@@ -1,56 +1,193 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, Request, Response, render_template, request
 from datetime import datetime
 import os
-import json
-import base64
+import shutil
+import tempfile
+import orjson
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 import uuid
+import queue
 import asyncio
-import nest_asyncio
+import threading
+import time
 from gemini_integration import GeminiIntegration 
+from response_cache import ResponseCache
+from session_store import create_session_store
+from intents import classify, CANNED_RESPONSES
+from conversation_memo import ConversationMemo, MEMO_EVERY, MEMO_KEEP_RECENT
 
-# Allow nested event loops
-nest_asyncio.apply()
+# Worker processes spawned for PDF extraction re-import the main module as
+# __mp_main__ when the app is started with `python app.py`. They only need
+# importable definitions, so they skip the loop thread and the AI clients
+IS_SPAWNED_WORKER = __name__ == '__mp_main__'
+
+# Persistent event loop shared by all requests so the AI clients keep
+# their connections warm instead of paying setup cost on every message
+loop = asyncio.new_event_loop()
+if not IS_SPAWNED_WORKER:
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+class StreamedRequest(Request):
+    """Request that always spools uploaded files to disk rather than memory"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.TemporaryFile('wb+')
 
 app = Flask(__name__)
+app.request_class = StreamedRequest
 app.secret_key = 'your-secret-key-change-this-in-production'
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'mp4', 'avi', 'mov', 'wav', 'mp3', 'ogg', 'webm'}
+# Allowed extensions mapped to the message type they are handled as
+EXT_MAP = {
+    'jpg': 'image', 'jpeg': 'image', 'png': 'image', 'gif': 'image',
+    'mp4': 'video', 'avi': 'video', 'mov': 'video',
+    'wav': 'audio', 'mp3': 'audio', 'ogg': 'audio', 'webm': 'audio',
+    'pdf': 'pdf',
+    'txt': 'document'
+}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+UPLOAD_CHUNK_SIZE = 64 * 1024
+AI_RESPONSE_TIMEOUT = 60  # seconds
+STREAM_HEARTBEAT = 15  # seconds between keep-alive comments on /stream
+STREAM_MAX_AGE = 300  # seconds before /stream ends; the browser reconnects if it still needs it
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Werkzeug rejects larger bodies before they are read
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
 # Initialize Gemini Integration
-try:
-    gemini_client = GeminiIntegration()
-except Exception as e:
-    print(f"❌ Gemini integration failed: {e}")
-    gemini_client = None
+gemini_client = None
+if not IS_SPAWNED_WORKER:
+    try:
+        gemini_client = GeminiIntegration()
+    except Exception as e:
+        print(f"❌ Gemini integration failed: {e}")
+
+# Establish the Gemini connection on the shared loop so it is reused by every request
+if gemini_client:
+    asyncio.run_coroutine_threadsafe(gemini_client.warm_up(), loop)
+
+# Cache of text responses so repeated questions skip the Gemini round-trip
+response_cache = (
+    ResponseCache(gemini_client.embed_text, redis_url=os.environ.get('REDIS_URL'))
+    if gemini_client else None
+)
 
-# In-memory chat storage
-chat_sessions = {}
+# Chat storage: Redis when REDIS_URL is set, else LRU-bounded process memory
+chat_sessions = create_session_store()
 
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# Sessions whose memo is currently being updated
+memo_folds = set()
+memo_lock = threading.Lock()
+
+# Browser tabs listening on /stream/<session_id>, one queue per connection
+stream_listeners = {}
+stream_lock = threading.Lock()
+
+def ojsonify(obj):
+    """jsonify replacement that serializes with orjson"""
+    return app.response_class(orjson.dumps(obj), mimetype='application/json')
 
 def get_file_type(filename):
-    """Determine file type based on extension"""
-    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-    if ext in ['jpg', 'jpeg', 'png', 'gif']:
-        return 'image'
-    elif ext in ['mp4', 'avi', 'mov']:
-        return 'video'
-    elif ext in ['wav', 'mp3', 'ogg', 'webm']:
-        return 'audio'
-    elif ext == 'pdf':
-        return 'pdf'
-    else:
-        return 'document'
+    """Determine file type based on extension, or None if it is not allowed"""
+    _, dot, ext = filename.rpartition('.')
+    return EXT_MAP.get(ext.lower()) if dot else None
+
+async def generate_ai_response_async(message_content, message_type='text', file_path=None, conversation_history=None, session_id=None):
+    """Dispatch the message to the matching Gemini handler"""
+    if message_type == 'image' and file_path:
+        return await gemini_client.process_image_message(
+            image_path=file_path,
+            text_message=message_content,
+            conversation_history=conversation_history,
+            conversation_id=session_id
+        )
+    elif message_type in ['audio', 'video'] and file_path:
+        return await gemini_client.process_audio_message(
+            audio_path=file_path,
+            text_message=message_content,
+            conversation_history=conversation_history,
+            conversation_id=session_id
+        )
+    elif message_type == 'pdf' and file_path:
+        return await gemini_client.process_pdf_document(
+            pdf_path=file_path,
+            text_message=message_content,
+            conversation_history=conversation_history,
+            conversation_id=session_id
+        )
+    else:  # Text message
+        return await gemini_client.process_text_message(
+            message=message_content,
+            conversation_history=conversation_history,
+            conversation_id=session_id
+        )
+
+def build_conversation_history(session_id):
+    """
+    History sent with a message: the session memo followed by every message
+    not yet folded into it. Once MEMO_EVERY messages beyond the last
+    MEMO_KEEP_RECENT are waiting, the oldest ones are folded in the background.
+    """
+    memo, memo_upto = chat_sessions.get_memo(session_id)
+    unfolded = [
+        msg for msg in chat_sessions.recent(session_id, MEMO_EVERY + MEMO_KEEP_RECENT)
+        if msg['id'] > memo_upto
+    ]
+    if gemini_client and len(unfolded) >= MEMO_EVERY + MEMO_KEEP_RECENT:
+        fold_memo_in_background(session_id, memo, unfolded[:MEMO_EVERY])
+    
+    if memo:
+        return [ConversationMemo.history_entry(memo)] + unfolded
+    return unfolded
+
+def fold_memo_in_background(session_id, memo, messages):
+    """Fold messages into the session memo on the shared loop"""
+    with memo_lock:
+        if session_id in memo_folds:
+            return
+        memo_folds.add(session_id)
+    
+    def store_memo(future):
+        try:
+            chat_sessions.set_memo(session_id, future.result(), messages[-1]['id'])
+        except Exception as e:
+            print(f"Memo update failed: {e}")
+        finally:
+            with memo_lock:
+                memo_folds.discard(session_id)
+    
+    future = asyncio.run_coroutine_threadsafe(gemini_client.memo.fold(memo, messages), loop)
+    future.add_done_callback(store_memo)
+
+def lookup_ready_response(message_content, message_type, file_path, conversation_history):
+    """
+    Answer from a canned intent or the response cache when possible.
+    Returns (response, cache_key, embedding): response is None on a miss, and
+    cache_key ((message, previous turn)) and embedding are what
+    response_cache.put() needs once it is answered.
+    """
+    # Opening greetings and common issues get a canned answer without an API call
+    # (the history only holds the message being answered on a first turn)
+    if message_type == 'text' and len(conversation_history) <= 1:
+        fast_intent = classify(message_content)
+        if fast_intent:
+            print(f"Fast intent '{fast_intent}' matched: {message_content!r}")
+            return CANNED_RESPONSES[fast_intent], None, None
+    
+    # Only plain text is cacheable. The message alone is compared for similarity,
+    # and only against messages that followed the same previous turn
+    if response_cache and message_type == 'text' and not file_path:
+        previous_turn = conversation_history[-2]['content'] if len(conversation_history) > 1 else ''
+        cache_key = (message_content, previous_turn)
+        cached_response, embedding = response_cache.lookup(message_content, previous_turn)
+        return cached_response, cache_key, embedding
+    
+    return None, None, None
 
 def generate_ai_response(message_content, message_type='text', file_path=None, session_id=None):
     """
@@ -60,46 +197,33 @@ def generate_ai_response(message_content, message_type='text', file_path=None, s
         return "The AI assistant is currently unavailable due to a configuration error."
     
     try:
-        conversation_history = chat_sessions.get(session_id, [])[-6:]
+        conversation_history = build_conversation_history(session_id)
+        ready_response, cache_key, embedding = lookup_ready_response(
+            message_content, message_type, file_path, conversation_history
+        )
+        if ready_response:
+            return ready_response
         
-        # Get or create event loop
-        # try:
-        loop = asyncio.get_event_loop()
-        # except RuntimeError:
-        #     loop = asyncio.new_event_loop()
-        #     asyncio.set_event_loop(loop)
+        # Run on the shared background loop instead of spinning up a new one.
+        # wait_for cancels the work itself on timeout, so an abandoned request
+        # stops calling Gemini and never checks in its chat session
+        response_data = asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(
+                generate_ai_response_async(
+                    message_content=message_content,
+                    message_type=message_type,
+                    file_path=file_path,
+                    conversation_history=conversation_history,
+                    session_id=session_id
+                ),
+                AI_RESPONSE_TIMEOUT
+            ),
+            loop
+        ).result()
         
-        if message_type == 'image' and file_path:
-            response_data = loop.run_until_complete(
-                gemini_client.process_image_message(
-                    image_path=file_path,
-                    text_message=message_content,
-                    conversation_history=conversation_history
-                )
-            )
-        elif message_type in ['audio', 'video'] and file_path:
-            response_data = loop.run_until_complete(
-                gemini_client.process_audio_message(
-                    audio_path=file_path,
-                    text_message=message_content,
-                    conversation_history=conversation_history
-                )
-            )
-        elif message_type == 'pdf' and file_path:
-            response_data = loop.run_until_complete(
-                gemini_client.process_pdf_document(
-                    pdf_path=file_path,
-                    text_message=message_content,
-                    conversation_history=conversation_history
-                )
-            )
-        else:  # Text message
-            response_data = loop.run_until_complete(
-                gemini_client.process_text_message(
-                    message=message_content,
-                    conversation_history=conversation_history
-                )
-            )
+        if cache_key and response_data['success']:
+            message, previous_turn = cache_key
+            response_cache.put(message, response_data['response'], embedding, previous_turn)
         
         return response_data['response'] if response_data['success'] else response_data['error']
     
@@ -107,6 +231,88 @@ def generate_ai_response(message_content, message_type='text', file_path=None, s
         print(f"AI Response Error: {e}")
         return "I'm experiencing technical difficulties. Please try again or contact Telkom support."
 
+def publish_message(session_id, message):
+    """Push a message to every open /stream connection for the session"""
+    with stream_lock:
+        listeners = list(stream_listeners.get(session_id, []))
+    for listener in listeners:
+        listener.put(message)
+
+def has_stream_listener(session_id):
+    with stream_lock:
+        return bool(stream_listeners.get(session_id))
+
+def deliver_ai_response(session_id, future, message_id=None):
+    """Store the AI reply for a background request and push it to the browser"""
+    try:
+        response_data = future.result()
+        content = response_data['response'] if response_data['success'] else response_data['error']
+    except Exception as e:
+        print(f"AI Response Error: {e}")
+        content = "I'm experiencing technical difficulties. Please try again or contact Telkom support."
+    
+    ai_message = {
+        'id': message_id or chat_sessions.next_message_id(session_id),
+        'type': 'ai',
+        'content': content,
+        'message_type': 'text',
+        'timestamp': datetime.now().strftime('%H:%M')
+    }
+    chat_sessions.append(session_id, ai_message)
+    publish_message(session_id, ai_message)
+
+def generate_ai_response_in_background(message_content, message_type, file_path, session_id):
+    """Start generating a reply on the shared loop without waiting for it"""
+    future = asyncio.run_coroutine_threadsafe(
+        asyncio.wait_for(
+            generate_ai_response_async(
+                message_content=message_content,
+                message_type=message_type,
+                file_path=file_path,
+                conversation_history=build_conversation_history(session_id),
+                session_id=session_id
+            ),
+            AI_RESPONSE_TIMEOUT
+        ),
+        loop
+    )
+    future.add_done_callback(lambda f: deliver_ai_response(session_id, f))
+
+async def stream_ai_response_async(message_content, conversation_history, session_id, message_id, cache_key, embedding):
+    """Publish reply chunks to /stream as they arrive, then return the whole reply"""
+    chunks = []
+    try:
+        async for chunk in gemini_client.process_text_message_stream(
+            message=message_content,
+            conversation_history=conversation_history,
+            conversation_id=session_id
+        ):
+            chunks.append(chunk)
+            publish_message(session_id, {'id': message_id, 'type': 'ai', 'delta': chunk})
+    except Exception as e:
+        print(f"AI Response Error: {e}")
+        return {'success': False, 'error': "I'm experiencing technical difficulties. Please try again or contact Telkom support."}
+    
+    response_text = ''.join(chunks)
+    if cache_key:
+        message, previous_turn = cache_key
+        await asyncio.to_thread(response_cache.put, message, response_text, embedding, previous_turn)
+    return {'success': True, 'response': response_text}
+
+def stream_ai_response_in_background(message_content, conversation_history, session_id, cache_key, embedding):
+    """Start streaming a text reply over /stream without waiting for it"""
+    message_id = chat_sessions.next_message_id(session_id)
+    future = asyncio.run_coroutine_threadsafe(
+        asyncio.wait_for(
+            stream_ai_response_async(
+                message_content, conversation_history, session_id, message_id, cache_key, embedding
+            ),
+            AI_RESPONSE_TIMEOUT
+        ),
+        loop
+    )
+    future.add_done_callback(lambda f: deliver_ai_response(session_id, f, message_id))
+
 @app.route('/')
 def index():
     """Home page with chat interface"""
@@ -116,107 +322,186 @@ def index():
 def send_message():
     """Handle sending messages (text, files, voice notes)"""
     try:
+        file = request.files.get('file') or request.files.get('voice_data')
+        
+        # Reject disallowed uploads before any other work is done
+        file_type = None
+        if file and file.filename:
+            file_type = get_file_type(file.filename)
+            if not file_type:
+                return ojsonify({'status': 'error', 'message': 'File type not allowed.'})
+        
+        timestamp = datetime.now().strftime('%H:%M')
         session_id = request.form.get('session_id') or str(uuid.uuid4())
         
         if session_id not in chat_sessions:
             chat_sessions[session_id] = []
         
         text_message = request.form.get('message', '').strip()
-        file = request.files.get('file') or request.files.get('voice_data')
 
         user_message = None
         ai_response_text = None
 
-        if file and file.filename:
-            if allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_{filename}")
-                file.save(file_path)
-                
-                file_type = get_file_type(filename)
-                
-                # Create user message for display
-                if file_type == 'audio':
-                     display_content = "🎵 Voice message"
-                else:
-                     display_content = f"📎 {filename}"
-                
-                if text_message:
-                    display_content = f"{text_message} \n {display_content}"
-
-                user_message = {
-                    'id': len(chat_sessions[session_id]) + 1,
-                    'type': 'user',
-                    'content': display_content,
-                    'message_type': file_type,
-                    'file_path': file_path,
-                    'text_content': text_message,
-                    'timestamp': datetime.now().strftime('%H:%M')
-                }
-                chat_sessions[session_id].append(user_message)
-                
-                # Generate AI response
-                ai_response_text = generate_ai_response(
+        if file_type:
+            filename = secure_filename(file.filename)
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_{filename}")
+            with open(file_path, 'wb') as out:
+                shutil.copyfileobj(file.stream, out, length=UPLOAD_CHUNK_SIZE)
+            
+            # Create user message for display
+            if file_type == 'audio':
+                 display_content = "🎵 Voice message"
+            else:
+                 display_content = f"📎 {filename}"
+            
+            if text_message:
+                display_content = f"{text_message} \n {display_content}"
+
+            user_message = {
+                'id': chat_sessions.next_message_id(session_id),
+                'type': 'user',
+                'content': display_content,
+                'message_type': file_type,
+                'file_path': file_path,
+                'text_content': text_message,
+                'timestamp': timestamp
+            }
+            chat_sessions.append(session_id, user_message)
+            
+            # Voice notes take long to process, so when the page is listening
+            # show the user's bubble right away and deliver the reply over /stream
+            if file_type == 'audio' and gemini_client and has_stream_listener(session_id):
+                generate_ai_response_in_background(
                     message_content=text_message,
                     message_type=file_type,
                     file_path=file_path,
                     session_id=session_id
                 )
-            else:
-                return jsonify({'status': 'error', 'message': 'File type not allowed.'})
+                return ojsonify({
+                    'status': 'success',
+                    'user_message': user_message,
+                    'ai_message': None,
+                    'session_id': session_id
+                })
+            
+            # Generate AI response
+            ai_response_text = generate_ai_response(
+                message_content=text_message,
+                message_type=file_type,
+                file_path=file_path,
+                session_id=session_id
+            )
 
         elif text_message:
             user_message = {
-                'id': len(chat_sessions[session_id]) + 1,
+                'id': chat_sessions.next_message_id(session_id),
                 'type': 'user',
                 'content': text_message,
                 'message_type': 'text',
-                'timestamp': datetime.now().strftime('%H:%M')
+                'timestamp': timestamp
             }
-            chat_sessions[session_id].append(user_message)
+            chat_sessions.append(session_id, user_message)
             
-            ai_response_text = generate_ai_response(
-                message_content=text_message,
-                message_type='text',
-                session_id=session_id
-            )
+            # With the page listening on /stream, send the reply there token by
+            # token instead of making the user wait for all of it
+            if gemini_client and has_stream_listener(session_id):
+                conversation_history = build_conversation_history(session_id)
+                ai_response_text, cache_key, embedding = lookup_ready_response(
+                    text_message, 'text', None, conversation_history
+                )
+                if not ai_response_text:
+                    stream_ai_response_in_background(
+                        text_message, conversation_history, session_id, cache_key, embedding
+                    )
+                    return ojsonify({
+                        'status': 'success',
+                        'user_message': user_message,
+                        'ai_message': None,
+                        'session_id': session_id
+                    })
+            else:
+                ai_response_text = generate_ai_response(
+                    message_content=text_message,
+                    message_type='text',
+                    session_id=session_id
+                )
         
         else:
-            return jsonify({'status': 'error', 'message': 'No content provided'})
+            return ojsonify({'status': 'error', 'message': 'No content provided'})
 
         if ai_response_text:
             ai_message = {
-                'id': len(chat_sessions[session_id]) + 1,
+                'id': chat_sessions.next_message_id(session_id),
                 'type': 'ai',
                 'content': ai_response_text,
                 'message_type': 'text',
-                'timestamp': datetime.now().strftime('%H:%M')
+                'timestamp': timestamp
             }
-            chat_sessions[session_id].append(ai_message)
+            chat_sessions.append(session_id, ai_message)
             
-            return jsonify({
+            return ojsonify({
                 'status': 'success',
                 'user_message': user_message,
                 'ai_message': ai_message,
                 'session_id': session_id
             })
 
-        return jsonify({'status': 'error', 'message': 'Could not generate AI response.'})
-            
+        return ojsonify({'status': 'error', 'message': 'Could not generate AI response.'})
+    
+    except HTTPException:
+        # e.g. RequestEntityTooLarge from reading request.files, handled by file_too_large
+        raise
     except Exception as e:
         print(f"ERROR in send_message: {e}")
-        return jsonify({'status': 'error', 'message': str(e)})
+        return ojsonify({'status': 'error', 'message': str(e)})
+
+@app.route('/stream/<session_id>')
+def stream(session_id):
+    """Server-sent events carrying AI replies that were generated in the background"""
+    listener = queue.Queue()
+    with stream_lock:
+        stream_listeners.setdefault(session_id, []).append(listener)
+    
+    def generate():
+        # Each open connection holds a worker thread, so connections are
+        # bounded to STREAM_MAX_AGE; EventSource reconnects after `retry` ms
+        deadline = time.monotonic() + STREAM_MAX_AGE
+        try:
+            yield "retry: 1000\n\n"
+            while True:
+                timeout = min(STREAM_HEARTBEAT, deadline - time.monotonic())
+                if timeout <= 0:
+                    break
+                try:
+                    message = listener.get(timeout=timeout)
+                    yield f"data: {orjson.dumps(message).decode()}\n\n"
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            with stream_lock:
+                listeners = stream_listeners.get(session_id, [])
+                if listener in listeners:
+                    listeners.remove(listener)
+                if not listeners:
+                    stream_listeners.pop(session_id, None)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.errorhandler(413)
+def file_too_large(e):
+    """Reply in the chat API format when an upload exceeds MAX_FILE_SIZE"""
+    return ojsonify({'status': 'error', 'message': 'File is too large (max 16MB).'}), 413
 
 @app.route('/get_chat_history/<session_id>')
 def get_chat_history(session_id):
     """Get chat history for a session"""
     if session_id in chat_sessions:
-        return jsonify({
+        return ojsonify({
             'status': 'success',
             'messages': chat_sessions[session_id]
         })
     else:
-        return jsonify({
+        return ojsonify({
             'status': 'success',
             'messages': []
         })
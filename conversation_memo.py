@@ -0,0 +1,51 @@
+import orjson
+from typing import Dict, List
+
+MEMO_EVERY = 6        # fold this many messages into the memo at a time
+MEMO_KEEP_RECENT = 4  # always send at least this many recent messages verbatim
+
+FOLD_INSTRUCTION = (
+    "You maintain a memo of a Telkom technical support conversation. Merge the new "
+    "messages into the existing memo, grouped by topic (for example the device, the "
+    "service, the problem, steps already tried, outcomes). Keep every fact needed to "
+    "continue helping the customer and drop small talk. Return only a JSON object "
+    "mapping each topic to a short summary, at most 200 words in total."
+)
+
+
+class ConversationMemo:
+    """
+    MemoChat-style memory: older turns are folded into a topic-indexed memo
+    so the history sent to Gemini is the memo plus a few recent messages,
+    instead of growing with the conversation or forgetting everything past
+    a fixed window.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    async def fold(self, memo: str, messages: List[Dict]) -> str:
+        """Return the memo updated with `messages`"""
+        transcript = [
+            {'role': msg['type'], 'text': msg.get('text_content') or msg.get('content', '')}
+            for msg in messages
+        ]
+        result = await self.model.generate_content_async(
+            [
+                FOLD_INSTRUCTION,
+                f"Existing memo: {memo or '{}'}",
+                f"New messages: {orjson.dumps(transcript).decode()}"
+            ],
+            generation_config={'response_mime_type': 'application/json'}
+        )
+        # Validate before storing so a malformed reply keeps the old memo
+        orjson.loads(result.text)
+        return result.text
+
+    @staticmethod
+    def history_entry(memo: str) -> Dict:
+        """Chat history message that carries the memo into the next turn"""
+        return {
+            'type': 'user',
+            'content': f"Summary of our earlier conversation (for context): {memo}"
+        }
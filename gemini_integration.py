@@ -1,16 +1,188 @@
 import os
 import logging
+import asyncio
+import mmap
+import mimetypes
+import multiprocessing
+import textwrap
+import threading
+import time
+import functools
+import blake3
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple, Union
 import google.generativeai as genai
-from PIL import Image
+from google.generativeai import client as genai_client
+from google.ai import generativelanguage as glm
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+    GenerativeServiceGrpcAsyncIOTransport
+)
 import PyPDF2
-import time
+import pypdfium2 as pdfium
+try:
+    from faster_whisper import WhisperModel, decode_audio
+except ImportError:  # optional: voice notes are then always uploaded to Gemini
+    WhisperModel = decode_audio = None
+from sampling_coordinator import SamplingCoordinator
+from pdf_text_cache import PdfTextCache
+from pdf_pages import page_text, join_page_text, extract_page_range
+from conversation_memo import ConversationMemo, MEMO_EVERY, MEMO_KEEP_RECENT
+
+__all__ = ['GeminiIntegration']
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+HISTORY_CACHE_SIZE = 1024
+CHAT_SESSION_CACHE_SIZE = 1024
+CHAT_SESSION_IDLE = 30 * 60  # seconds
+CHAT_SESSION_MAX_TURNS = MEMO_EVERY + MEMO_KEEP_RECENT  # then reseed so the memo is picked up
+AUDIO_POLL_INITIAL = 0.25  # seconds
+AUDIO_POLL_BACKOFF = 1.6
+AUDIO_POLL_MAX = 3.0
+LOCAL_TRANSCRIBE_FORMATS = {'.wav', '.mp3', '.ogg', '.webm'}
+LOCAL_TRANSCRIBE_MAX_SECONDS = 60  # longer notes would outlast the reply timeout on a CPU
+WHISPER_SAMPLE_RATE = 16000
+WHISPER_MODEL = os.environ.get('WHISPER_MODEL', 'small')
+INLINE_IMAGE_MAX_BYTES = 4 * 1024 * 1024  # larger images go through the File API
+MAX_PDF_PAGES = 50  # The prompt only uses the first few thousand characters
+PDF_PROMPT_CHARS = 8000
+SEQUENTIAL_PDF_MAX_PAGES = 10  # Always read in process; the pool only takes pages beyond these
+LIGHT_PDF_MAX_PAGES = 20  # ...and up to this when pages are text-only (small file)
+LIGHT_PDF_MAX_MB = 1
+MAX_PDF_WORKERS = 4
+PDF_PAGES_PER_TASK = 4
+
+# Sent as the system instruction on every call. Keep it byte-for-byte static:
+# Gemini's implicit prompt caching only applies to an identical leading prefix,
+# so anything per-request (PDF text, audio hints, history) goes in user parts.
+# It is dedented once at import so no indentation is sent (and billed) with it.
+_STATIC_SYSTEM_PROMPT = textwrap.dedent("""\
+    DONT INCLUDE ANY BOLD TEXT OR FANCY FORMATTING, we need the text as a whatsapp text message.
+    You are T-Help, an expert Telkom technical support assistant. Your role is to help customers troubleshoot technical issues with their Telkom services including:
+    - Internet connectivity problems (Wi-Fi, ADSL/Fiber)
+    - Mobile network problems
+    - Device and email configuration
+    - Network speed and performance issues
+    When analyzing files/images:
+    - Screenshots: Identify error messages and provide solutions.
+    - Bills/Documents: Help understand technical service details.
+    - Videos: Describe technical procedures shown.
+    Always be helpful, patient, and professional. Provide step-by-step instructions and ask clarifying questions. Respond in the same language as the customer's query.
+    """).strip()
+
+_pdf_executor = None
+# PDFium is not thread-safe, so in-process use is serialized and documents
+# large enough to parallelize are spread over worker processes instead
+_pdfium_lock = threading.Lock()
+_whisper_model = None
+_whisper_lock = threading.Lock()
+# Transcription gets its own single thread, so a slow note never ties up
+# the default executor used for PDF, cache and file work
+_whisper_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='whisper')
+
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    """Lazily create the process pool shared by all PDF extractions"""
+    global _pdf_executor
+    if _pdf_executor is None:
+        # spawn rather than fork: the parent runs gRPC and event loop threads
+        _pdf_executor = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pdf_executor
+
+
+# Ping the Gemini connection so idle periods (and NAT timeouts) do not force
+# a fresh TCP+TLS handshake on the next message
+GRPC_KEEPALIVE_OPTIONS = [
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.keepalive_permit_without_calls', 1),
+]
+
+
+def _keepalive_channel(*args, options=(), **kwargs):
+    return GenerativeServiceGrpcAsyncIOTransport.create_channel(
+        *args, options=[*options, *GRPC_KEEPALIVE_OPTIONS], **kwargs
+    )
+
+
+def _install_keepalive_client():
+    """
+    Give the SDK a generative async client whose gRPC channel has keepalive
+    enabled. genai.configure has no way to pass channel options, so the
+    client is created the way the SDK would and placed in its client cache.
+    Must run on the event loop the async calls use.
+    """
+    client_manager = genai_client._client_manager
+    config = {
+        **client_manager.client_config,
+        'transport': lambda **kwargs: GenerativeServiceGrpcAsyncIOTransport(channel=_keepalive_channel, **kwargs)
+    }
+    client_manager.clients['generative_async'] = glm.GenerativeServiceAsyncClient(**config)
+
+
+_ROLE_MAP = {'user': 'user'}  # chat message type -> Gemini role; anything else is 'model'
+
+
+@functools.lru_cache(maxsize=8)
+def _get_model(api_key: str, model_name: str, system_prompt: str) -> genai.GenerativeModel:
+    """
+    One GenerativeModel per (key, model, system prompt), so constructing
+    another GeminiIntegration reuses the model and its connection.
+    """
+    return genai.GenerativeModel(model_name=model_name, system_instruction=system_prompt)
+
+
+@functools.lru_cache(maxsize=100)
+def _select_pdf_strategy(pages_bucket: int, size_bucket_mb: int) -> Tuple[str, int]:
+    """
+    Pick ('seq', 1) or ('process', workers) for a document shape. Callers
+    bucket pages to tens and size to whole MB so decisions are reusable.
+    """
+    if pages_bucket <= SEQUENTIAL_PDF_MAX_PAGES:
+        return 'seq', 1
+    if pages_bucket <= LIGHT_PDF_MAX_PAGES and size_bucket_mb < LIGHT_PDF_MAX_MB:
+        return 'seq', 1
+    tasks = -(-pages_bucket // PDF_PAGES_PER_TASK)
+    workers = min(os.cpu_count() or 1, MAX_PDF_WORKERS, tasks)
+    return ('process', workers) if workers > 1 else ('seq', 1)
+
+
+def _transcribe_locally(audio_path: str) -> Optional[str]:
+    """
+    Transcribe audio on the CPU with an int8 faster-whisper model, loaded on
+    first use. Returns None for notes longer than LOCAL_TRANSCRIBE_MAX_SECONDS.
+    """
+    global _whisper_model
+    # Browser recordings carry no duration header, so decode and count samples
+    audio = decode_audio(audio_path, sampling_rate=WHISPER_SAMPLE_RATE)
+    if len(audio) > LOCAL_TRANSCRIBE_MAX_SECONDS * WHISPER_SAMPLE_RATE:
+        return None
+    with _whisper_lock:
+        if _whisper_model is None:
+            _whisper_model = WhisperModel(WHISPER_MODEL, device='cpu', compute_type='int8')
+    segments, _ = _whisper_model.transcribe(audio, vad_filter=True)
+    return ' '.join(segment.text.strip() for segment in segments)
+
+
+_mime_types = {}  # file extension -> MIME type
+
+
+def _guess_mime_type(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    mime_type = _mime_types.get(ext)
+    if mime_type is None:
+        mime_type = mimetypes.guess_type(f"file{ext}")[0] or 'application/octet-stream'
+        _mime_types[ext] = mime_type
+    return mime_type
+
+
 class GeminiIntegration:
     """
     Google GenAI SDK Integration for T-Help Technical Support Chatbot
@@ -24,45 +196,124 @@ class GeminiIntegration:
             '.ogg': 'audio/ogg',
             '.webm': 'audio/webm'
         }
+        # Extracted PDF text keyed by a BLAKE3 hash of the file contents, in memory and on disk
+        self._pdf_text_cache = PdfTextCache()
+        # Converted chat turns keyed by (role, text); only touched on the event loop
+        self._history_cache = OrderedDict()
+        # conversation id -> (chat session, last used); only touched on the event loop
+        self._chat_sessions = OrderedDict()
         self.api_key = api_key or os.environ.get('GEMINI_API_KEY')
         if not self.api_key:
             raise ValueError("Google API key is required. Set GEMINI_API_KEY environment variable.")
         
         genai.configure(api_key=self.api_key)
         
-        self.system_prompt = self._create_telkom_system_prompt()
+        # Initialize single model for all operations, shared by every instance
+        self.model = _get_model(self.api_key, 'gemini-2.0-flash', _STATIC_SYSTEM_PROMPT)
         
-        # Initialize single model for all operations
-        self.model = genai.GenerativeModel(
-            model_name='gemini-2.0-flash',
-            system_instruction=self.system_prompt
-        )
+        # Coalesces concurrent text prompts into batched Gemini calls
+        self.coordinator = SamplingCoordinator(self.model, self._send_text)
+        
+        # Folds older turns into a per-session memo to keep history bounded
+        self.memo = ConversationMemo(self.model)
         
         logger.info("✅ Gemini integration initialized successfully")
 
-    def _create_telkom_system_prompt(self) -> str:
-        """Create specialized system prompt for Telkom technical support"""
-        return """DONT INCLUDE ANY BOLD TEXT OR FANCY FORMATTING, we need the text as a whatsapp text message.
-                You are T-Help, an expert Telkom technical support assistant. Your role is to help customers troubleshoot technical issues with their Telkom services including:
-                - Internet connectivity problems (Wi-Fi, ADSL/Fiber)
-                - Mobile network problems
-                - Device and email configuration
-                - Network speed and performance issues
-                When analyzing files/images:
-                - Screenshots: Identify error messages and provide solutions.
-                - Bills/Documents: Help understand technical service details.
-                - Videos: Describe technical procedures shown.
-                Always be helpful, patient, and professional. Provide step-by-step instructions and ask clarifying questions. Respond in the same language as the customer's query. 
-                """
-
-    def _format_history(self, history: List[Dict]) -> List[Dict]:
-        """Formats the chat history for the Gemini API."""
-        formatted = []
-        for msg in history:
-            role = 'user' if msg['type'] == 'user' else 'model'
-            content = msg.get('text_content', msg.get('content', ''))
-            formatted.append({'role': role, 'parts': [content]})
-        return formatted
+    @property
+    def system_prompt(self) -> str:
+        """Read-only: see _STATIC_SYSTEM_PROMPT"""
+        return _STATIC_SYSTEM_PROMPT
+
+    async def warm_up(self):
+        """
+        Open the Gemini connection before the first user message arrives.
+        The SDK keeps one gRPC (HTTP/2) channel per service and reuses it for
+        every call, so only the first request pays the TCP+TLS handshake.
+        The async channel is bound to the loop that creates it, so this must
+        run on the same loop the process_* coroutines use.
+        """
+        try:
+            _install_keepalive_client()
+        except Exception as e:
+            logger.warning(f"Could not enable gRPC keepalive: {str(e)}")
+        try:
+            await self.model.count_tokens_async("ping")
+            logger.info("✅ Gemini connection warmed up")
+        except Exception as e:
+            logger.warning(f"Gemini warm-up failed: {str(e)}")
+
+    def _format_history(self, history: List[Dict]) -> List[genai.protos.Content]:
+        """
+        Formats the chat history for the Gemini API.
+        Turns are returned as Content protos, which start_chat passes through
+        as-is, and each one is cached so a follow-up message only converts
+        the turns added since the previous call.
+        """
+        return [
+            self._history_turn(_ROLE_MAP.get(msg['type'], 'model'), msg.get('text_content') or msg.get('content') or '')
+            for msg in history
+        ]
+
+    def _history_turn(self, role: str, content: str) -> genai.protos.Content:
+        key = (role, content)
+        turn = self._history_cache.get(key)
+        if turn is None:
+            turn = genai.protos.Content(role=role, parts=[genai.protos.Part(text=content)])
+            self._history_cache[key] = turn
+            if len(self._history_cache) > HISTORY_CACHE_SIZE:
+                self._history_cache.popitem(last=False)
+        else:
+            self._history_cache.move_to_end(key)
+        return turn
+    
+    def _checkout_chat(self, conversation_id: str, conversation_history: List[Dict]):
+        """
+        Take the conversation's chat session if it is still in step with the
+        caller's history, otherwise start one seeded from that history.
+        A session is in step when the last AI reply the caller knows about is
+        the last turn it holds; canned or cached replies, errors, memo folds
+        and idle expiry all fall back to reseeding. The session is removed
+        while in use so concurrent messages never share one.
+        """
+        history = conversation_history or []
+        entry = self._chat_sessions.pop(conversation_id, None) if conversation_id else None
+        if entry:
+            chat_session, last_used = entry
+            last_reply = next(
+                (msg.get('text_content') or msg.get('content') for msg in reversed(history) if msg['type'] == 'ai'),
+                None
+            )
+            if (time.monotonic() - last_used < CHAT_SESSION_IDLE
+                    and len(chat_session.history) < CHAT_SESSION_MAX_TURNS
+                    and last_reply == ''.join(part.text for part in chat_session.history[-1].parts)):
+                return chat_session
+        return self.model.start_chat(history=self._format_history(history))
+
+    def _checkin_chat(self, conversation_id: str, chat_session, user_turn: str = None):
+        """
+        Keep a chat session for the conversation's next message. For turns
+        that carried a file (uploaded file reference, inline image bytes or
+        PDF text), user_turn replaces the last user turn with text only, so
+        later turns neither point at a deleted upload nor re-send the file.
+        """
+        if not conversation_id:
+            return
+        if user_turn is not None:
+            history = chat_session.history
+            history[-2] = self._history_turn('user', user_turn)
+        now = time.monotonic()
+        self._chat_sessions[conversation_id] = (chat_session, now)
+        # Entries are in last-used order, so idle and excess ones are at the front
+        while self._chat_sessions:
+            _, (_, last_used) = next(iter(self._chat_sessions.items()))
+            if len(self._chat_sessions) <= CHAT_SESSION_CACHE_SIZE and now - last_used < CHAT_SESSION_IDLE:
+                break
+            self._chat_sessions.popitem(last=False)
+
+    def embed_text(self, text: str) -> List[float]:
+        """Embed text for semantic similarity lookups"""
+        result = genai.embed_content(model='models/text-embedding-004', content=text)
+        return result['embedding']
     
     def _validate_audio_file(self, audio_path: str) -> Dict[str, Any]:
         """Validate audio file format and size"""
@@ -102,7 +353,8 @@ class GeminiIntegration:
         self,
         audio_path: str,
         text_message: str = "",
-        conversation_history: List[Dict] = None
+        conversation_history: List[Dict] = None,
+        conversation_id: str = None
     ) -> Dict[str, Any]:
         """Process audio file by uploading it to the File API with improved error handling."""
         try:
@@ -116,9 +368,32 @@ class GeminiIntegration:
             
             logger.info(f"Audio file validated: {validation['size']} bytes, type: {validation['mime_type']}")
             
+            # Short voice notes are transcribed locally and answered as text,
+            # which skips the upload and the wait for Gemini to process the file
+            if WhisperModel and validation['extension'] in LOCAL_TRANSCRIBE_FORMATS:
+                try:
+                    transcript = await asyncio.get_running_loop().run_in_executor(
+                        _whisper_executor, _transcribe_locally, audio_path
+                    )
+                except Exception as transcribe_error:
+                    logger.warning(f"Local transcription failed, uploading audio instead: {transcribe_error}")
+                    transcript = None
+                if transcript:
+                    logger.info(f"Audio transcribed locally: {len(transcript)} characters")
+                    prompt = f"Transcript of the customer's voice message: {transcript}"
+                    if text_message:
+                        prompt = f"{text_message}\n{prompt}"
+                    return await self.process_text_message(
+                        message=prompt,
+                        conversation_history=conversation_history,
+                        batch=False,
+                        conversation_id=conversation_id
+                    )
+            
             # Upload file with explicit MIME type
             try:
-                audio_file = genai.upload_file(
+                audio_file = await asyncio.to_thread(
+                    genai.upload_file,
                     path=audio_path,
                     mime_type=validation['mime_type']
                 )
@@ -130,15 +405,18 @@ class GeminiIntegration:
             # Wait for processing with better status monitoring
             max_wait = 60  # Increased wait time for larger files
             waited = 0
-            check_interval = 3
+            # Short clips are usually ready within a second, so start polling
+            # quickly and back off for longer ones
+            check_interval = AUDIO_POLL_INITIAL
             
             logger.info("Waiting for audio file processing...")
             while audio_file.state.name == "PROCESSING" and waited < max_wait:
-                time.sleep(check_interval)
+                await asyncio.sleep(check_interval)
                 waited += check_interval
+                check_interval = min(check_interval * AUDIO_POLL_BACKOFF, AUDIO_POLL_MAX)
                 try:
-                    audio_file = genai.get_file(audio_file.name)
-                    logger.info(f"Audio processing status: {audio_file.state.name} (waited {waited}s)")
+                    audio_file = await asyncio.to_thread(genai.get_file, audio_file.name)
+                    logger.info(f"Audio processing status: {audio_file.state.name} (waited {waited:.1f}s)")
                 except Exception as status_error:
                     logger.error(f"Error checking file status: {str(status_error)}")
                     break
@@ -162,17 +440,16 @@ class GeminiIntegration:
             logger.info(f"✅ Audio file {audio_file.name} is now ACTIVE and ready for processing.")
 
             # Create chat session and send message
-            chat_session = self.model.start_chat(
-                history=self._format_history(conversation_history or [])
-            )
+            chat_session = self._checkout_chat(conversation_id, conversation_history)
             
             user_prompt = text_message or "Please transcribe and analyze this audio message. If you hear any Telkom technical support issues or questions, provide helpful troubleshooting assistance."
             
-            response = chat_session.send_message([user_prompt, audio_file])
+            response = await chat_session.send_message_async([user_prompt, audio_file])
+            self._checkin_chat(conversation_id, chat_session, text_message or "🎵 Voice message")
             
             # Clean up uploaded file (optional - Gemini will auto-delete after 48 hours)
             try:
-                genai.delete_file(audio_file.name)
+                await asyncio.to_thread(genai.delete_file, audio_file.name)
                 logger.info(f"Cleaned up uploaded file: {audio_file.name}")
             except Exception as cleanup_error:
                 logger.warning(f"Could not clean up file: {cleanup_error}")
@@ -184,7 +461,7 @@ class GeminiIntegration:
                 'audio_info': {
                     'size': validation['size'],
                     'type': validation['mime_type'],
-                    'processing_time': f"{waited}s"
+                    'processing_time': f"{waited:.1f}s"
                 },
                 'timestamp': datetime.now().isoformat()
             }
@@ -193,21 +470,42 @@ class GeminiIntegration:
             logger.error(f"Error processing audio with Gemini: {str(e)}")
             return self._create_error_response(e)
 
+    async def _send_text(
+        self,
+        message: Union[str, List[str]],
+        conversation_history: List[Dict],
+        conversation_id: str = None,
+        chat_session=None,
+        user_turn: str = None
+    ) -> str:
+        """
+        Send a single text turn, on the conversation's chat session if one is
+        given. Callers that already checked out the chat pass it in; see
+        _checkin_chat for user_turn.
+        """
+        if chat_session is None:
+            chat_session = self._checkout_chat(conversation_id, conversation_history)
+        response = await chat_session.send_message_async(message)
+        self._checkin_chat(conversation_id, chat_session, user_turn)
+        return response.text
+
     async def process_text_message(
         self, 
-        message: str, 
-        conversation_history: List[Dict] = None
+        message: Union[str, List[str]], 
+        conversation_history: List[Dict] = None,
+        batch: bool = True,
+        conversation_id: str = None
     ) -> Dict[str, Any]:
         """Process text message and generate AI response"""
         try:
-            chat_session = self.model.start_chat(
-                history=self._format_history(conversation_history or [])
-            )
-            response = chat_session.send_message(message)
+            if batch:
+                response_text = await self.coordinator.submit(message, conversation_history or [])
+            else:
+                response_text = await self._send_text(message, conversation_history or [], conversation_id)
             
             return {
                 'success': True,
-                'response': response.text,
+                'response': response_text,
                 'model_used': 'gemini-2.0-flash',
                 'timestamp': datetime.now().isoformat()
             }
@@ -215,27 +513,64 @@ class GeminiIntegration:
             logger.error(f"Error processing text with Gemini: {str(e)}")
             return self._create_error_response(e)
 
+    async def process_text_message_stream(
+        self,
+        message: Union[str, List[str]],
+        conversation_history: List[Dict] = None,
+        conversation_id: str = None
+    ) -> AsyncIterator[str]:
+        """
+        Yield the reply to a text message as it is generated, so it can be
+        shown before the whole reply is ready. Streamed turns are never
+        batched, and errors are raised to the caller.
+        """
+        chat_session = self._checkout_chat(conversation_id, conversation_history)
+        response = await chat_session.send_message_async(message, stream=True)
+        async for chunk in response:
+            if chunk.parts:
+                yield chunk.text
+        self._checkin_chat(conversation_id, chat_session)
+
     async def process_image_message(
         self, 
         image_path: str, 
         text_message: str = "",
-        conversation_history: List[Dict] = None
+        conversation_history: List[Dict] = None,
+        conversation_id: str = None
     ) -> Dict[str, Any]:
         """Process image with optional text message and history"""
         try:
             if not os.path.exists(image_path):
                 raise FileNotFoundError(f"Image file not found: {image_path}")
             
-            img = Image.open(image_path)
+            # The image bytes are sent as-is; there is no need to decode them locally
+            mime_type = _guess_mime_type(image_path)
+            uploaded_file = None
+            if os.path.getsize(image_path) <= INLINE_IMAGE_MAX_BYTES:
+                data = await asyncio.to_thread(self._read_file, image_path)
+                image_part = {'mime_type': mime_type, 'data': data}
+            else:
+                uploaded_file = await asyncio.to_thread(
+                    genai.upload_file,
+                    path=image_path,
+                    mime_type=mime_type
+                )
+                image_part = uploaded_file
             
-            chat_session = self.model.start_chat(
-                history=self._format_history(conversation_history or [])
-            )
+            chat_session = self._checkout_chat(conversation_id, conversation_history)
 
             user_prompt = text_message or "Please analyze this image for any Telkom technical support issues or error messages."
-            message_parts = [user_prompt, img]
+            message_parts = [user_prompt, image_part]
             
-            response = chat_session.send_message(message_parts)
+            try:
+                response = await chat_session.send_message_async(message_parts)
+                self._checkin_chat(conversation_id, chat_session, text_message or "📎 Image")
+            finally:
+                if uploaded_file:
+                    try:
+                        await asyncio.to_thread(genai.delete_file, uploaded_file.name)
+                    except Exception as cleanup_error:
+                        logger.warning(f"Could not clean up file: {cleanup_error}")
             
             return {
                 'success': True,
@@ -251,45 +586,162 @@ class GeminiIntegration:
         self, 
         pdf_path: str, 
         text_message: str = "",
-        conversation_history: List[Dict] = None
+        conversation_history: List[Dict] = None,
+        conversation_id: str = None
     ) -> Dict[str, Any]:
         """Process PDF document by extracting text"""
         try:
             if not os.path.exists(pdf_path):
                 raise FileNotFoundError(f"PDF file not found: {pdf_path}")
             
-            pdf_text = self._extract_pdf_text(pdf_path)
-            combined_message = f"""
-            User message: {text_message}
-            
-            PDF Content:
-            {pdf_text[:8000]}
+            # Extraction runs in a worker thread, so prepare the chat meanwhile.
+            # Yield once so the task hands the work to its thread before the
+            # synchronous checkout below runs
+            pdf_task = asyncio.create_task(
+                asyncio.to_thread(self._extract_pdf_text, pdf_path, PDF_PROMPT_CHARS)
+            )
+            await asyncio.sleep(0)
+            chat_session = self._checkout_chat(conversation_id, conversation_history)
+            pdf_text = await pdf_task
             
-            Please analyze the document content and help with any Telkom technical issues mentioned.
-            """
+            # Document and request travel as separate user parts so the
+            # system instruction stays the only fixed prefix
+            message_parts = [
+                f"PDF Content:\n{pdf_text}",
+                text_message or "Please analyze the document content and help with any Telkom technical issues mentioned."
+            ]
             
-            return await self.process_text_message(
-                message=combined_message, 
-                conversation_history=conversation_history
+            # Large document prompts are sent on their own rather than batched
+            response_text = await self._send_text(
+                message_parts, conversation_history, conversation_id, chat_session,
+                user_turn=text_message or "📎 PDF document"
             )
             
+            return {
+                'success': True,
+                'response': response_text,
+                'model_used': 'gemini-2.0-flash',
+                'timestamp': datetime.now().isoformat()
+            }
+            
         except Exception as e:
             logger.error(f"Error processing PDF with Gemini: {str(e)}")
             return self._create_error_response(e)
 
-    def _extract_pdf_text(self, pdf_path: str) -> str:
-        """Extract text from PDF file"""
+    async def process_batch(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Process several messages concurrently. Each request is a dict with a
+        'type' ('text', 'image', 'audio' or 'pdf') plus the keyword arguments
+        of the matching process_* method. Results keep the request order.
+        """
+        handlers = {
+            'text': self.process_text_message,
+            'image': self.process_image_message,
+            'audio': self.process_audio_message,
+            'pdf': self.process_pdf_document
+        }
+        return await asyncio.gather(*[
+            handlers[req['type']](**{k: v for k, v in req.items() if k != 'type'})
+            for req in requests
+        ])
+
+    def _read_file(self, path: str) -> bytes:
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def _hash_file(self, path: str) -> str:
+        """
+        128-bit BLAKE3 fingerprint of a file. The file is memory-mapped and
+        hashed with SIMD across several threads, without a Python bytes copy.
+        """
+        hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        return hasher.update_mmap(path).hexdigest(length=16)
+
+    def _extract_pdf_text(self, pdf_path: str, max_chars: int = PDF_PROMPT_CHARS) -> str:
+        """
+        Extract up to max_chars of text from a PDF file, reusing earlier
+        extractions of the same content. Pages are read lazily, so long
+        documents stop being parsed once the limit is reached.
+        """
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() or ''
-                return text
+            digest = self._hash_file(pdf_path)
+            cached_text = self._pdf_text_cache.get(digest, max_chars)
+            if cached_text is not None:
+                return cached_text
+            
+            try:
+                text = self._extract_pdf_text_pdfium(pdf_path, max_chars)
+            except Exception as pdfium_error:
+                logger.warning(f"PDFium extraction failed, falling back to PyPDF2: {pdfium_error}")
+                text = self._extract_pdf_text_pypdf2(pdf_path, max_chars)
+            
+            self._pdf_text_cache.put(digest, max_chars, text)
+            return text
         except Exception as e:
             logger.error(f"Error extracting PDF text: {str(e)}")
             return "Could not extract text from PDF."
 
+    def _extract_pdf_text_pdfium(self, pdf_path: str, max_chars: int) -> str:
+        """Extract text with PDFium (native), stopping at the prompt limit"""
+        # PDFium is given the path and reads the file natively, so no Python copy is made
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                page_count = min(len(pdf), MAX_PDF_PAGES)
+                # Most documents fill max_chars within their first pages, so
+                # those are read in process; only sparse documents (scans,
+                # slides) have their remaining pages spread over the pool
+                head_pages = min(page_count, SEQUENTIAL_PDF_MAX_PAGES)
+                head = join_page_text((page_text(pdf, i) for i in range(head_pages)), max_chars)
+                if len(head) >= max_chars or head_pages == page_count:
+                    return head
+                rest_chars = max_chars - len(head) - 1  # room left after the joining newline
+                strategy, workers = _select_pdf_strategy(
+                    -(-page_count // 10) * 10,
+                    os.path.getsize(pdf_path) // (1024 * 1024)
+                )
+                if strategy == 'seq':
+                    rest = join_page_text((page_text(pdf, i) for i in range(head_pages, page_count)), rest_chars)
+                    return f"{head}\n{rest}"
+            finally:
+                pdf.close()
+        rest = self._extract_pdf_text_parallel(pdf_path, head_pages, page_count, workers, rest_chars)
+        return f"{head}\n{rest}"
+
+    def _extract_pdf_text_pypdf2(self, pdf_path: str, max_chars: int) -> str:
+        """Pure-Python fallback for documents PDFium cannot open"""
+        # PyPDF2 reads the mmap directly instead of through buffered file reads
+        with open(pdf_path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pdf_reader = PyPDF2.PdfReader(mm)
+            return join_page_text(
+                (page.extract_text() or '' for page in pdf_reader.pages[:MAX_PDF_PAGES]),
+                max_chars
+            )
+
+    def _extract_pdf_text_parallel(
+        self, pdf_path: str, first_page: int, page_count: int, workers: int, max_chars: int
+    ) -> str:
+        """
+        Fan page ranges from first_page on out across the process pool, one
+        wave of `workers` ranges at a time, and stop once max_chars have
+        been collected.
+        """
+        executor = _get_pdf_executor()
+        ranges = [
+            (pdf_path, start, min(start + PDF_PAGES_PER_TASK, page_count), max_chars)
+            for start in range(first_page, page_count, PDF_PAGES_PER_TASK)
+        ]
+        parts = []
+        total = 0
+        for i in range(0, len(ranges), workers):
+            for range_text in executor.map(extract_page_range, ranges[i:i + workers]):
+                parts.append(range_text)
+                total += len(range_text)
+                if total >= max_chars:
+                    return '\n'.join(parts)[:max_chars]
+        return '\n'.join(parts)[:max_chars]
+
     def _create_error_response(self, error: Exception) -> Dict[str, Any]:
         """Create standardized error response"""
         return {
@@ -0,0 +1,16 @@
+import os
+
+# Handlers spend almost all their time waiting on Gemini, so use threaded
+# workers: each thread blocks on the shared event loop in app.py while the
+# other threads keep serving requests
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+worker_class = 'gthread'
+# Only raise WEB_CONCURRENCY above 1 with REDIS_URL set, since in-memory
+# sessions are not shared between worker processes
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Every open /stream connection also holds a thread. The page only opens one
+# while it is waiting for replies (closing it after a minute and a half idle)
+# and the server ends it after STREAM_MAX_AGE, so size this above the number
+# of customers expected to be chatting at the same time
+threads = int(os.environ.get('GUNICORN_THREADS', 64))
+timeout = 120
@@ -0,0 +1,71 @@
+import re
+from typing import Optional
+
+# Local keyword classifier for opening messages that have a canned answer,
+# so they can be handled without a Gemini round-trip
+
+GREETING_WORDS = frozenset({
+    'hi', 'hello', 'hey', 'hallo', 'howzit', 'morning', 'afternoon', 'evening',
+    'good', 'there', 'sawubona', 'molo', 'dumela', 't-help', 'thelp'
+})
+# A connection problem needs both a service and a symptom, and no sign of
+# a question or an account/billing request the canned steps would not answer
+INTERNET_SERVICE_RE = re.compile(r'\b(internet|wi-?fi|connection|fibre|fiber|adsl|dsl|router|network|line)\b', re.I)
+INTERNET_PROBLEM_RE = re.compile(
+    r"\b(not working|isn'?t working|is down|went down|slow|keeps? (dropping|disconnecting)"
+    r"|dropping|disconnect(s|ed|ing)?|(can'?t|cannot|won'?t) connect|offline)\b",
+    re.I
+)
+INTERNET_EXCLUDE_RE = re.compile(
+    r'\b(how|what|why|when|where|which|who|bill|billing|invoice|pay|payment|price|cost|charged'
+    r'|upgrade|package|cancel|contract|account)\b',
+    re.I
+)
+WORD_RE = re.compile(r"[\w-]+")
+MAX_INTENT_WORDS = 8  # Longer messages usually carry detail the model should see
+
+CANNED_RESPONSES = {
+    'greeting': (
+        "Hi, I'm T-Help, your Telkom technical support assistant. "
+        "How can I help you today? You can describe the problem, or send a screenshot, "
+        "document or voice note."
+    ),
+    'internet_issue': (
+        "Sorry to hear you're having connection trouble. Let's try a few quick steps:\n"
+        "1. Restart your router: unplug it for 30 seconds, then plug it back in and wait 2 minutes.\n"
+        "2. Check whether other devices have the same problem.\n"
+        "3. If you're on Wi-Fi, move closer to the router or try a cable.\n"
+        "4. Check that the router's DSL/Fibre and Internet lights are on.\n"
+        "If it still isn't working, tell me which lights are on and what device you're using."
+    ),
+}
+
+
+def classify(message: str) -> Optional[str]:
+    """
+    Return a canned intent name when the message matches one confidently
+
+    >>> classify("Hi there")
+    'greeting'
+    >>> classify("my wifi is not working")
+    'internet_issue'
+    >>> classify("fibre keeps dropping")
+    'internet_issue'
+    >>> classify("How do I upgrade my internet package?") is None
+    True
+    >>> classify("Why is my internet bill so high") is None
+    True
+    >>> classify("cancel my fibre connection please") is None
+    True
+    >>> classify("my TV decoder is not working") is None
+    True
+    """
+    words = WORD_RE.findall(message.lower())
+    if not words or len(words) > MAX_INTENT_WORDS:
+        return None
+    if all(word in GREETING_WORDS for word in words):
+        return 'greeting'
+    if (INTERNET_SERVICE_RE.search(message) and INTERNET_PROBLEM_RE.search(message)
+            and not INTERNET_EXCLUDE_RE.search(message)):
+        return 'internet_issue'
+    return None
@@ -1,19 +1,160 @@
 import openai
+import httpx
 import os
+import re
 import logging
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, AsyncIterator, Optional, List
 import asyncio
+import weakref
+import time
 import base64
 from io import BytesIO
-from PIL import Image
-import speech_recognition as sr
-import PyPDF2
+import pypdf
+import blake3
+import diskcache
+from openai.types.chat import ChatCompletion
+import tiktoken
+from response_cache import ResponseCache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SEMANTIC_CACHE_MAX_HISTORY = 8  # longer conversations only use exact cache matches
+PDF_EXTRACT_CHARS = 8000  # characters extracted, enough to fill PDF_PROMPT_TOKENS
+PDF_PROMPT_TOKENS = 1500  # tokens of PDF text included in the prompt
+CONTEXT_TOKENS = 8192  # context budget per request, within every fallback model's window
+TOKEN_SAFETY_MARGIN = 256  # per-message overhead and tokenizer differences between models
+HISTORY_WINDOW = 6  # history messages sent with each request (up to 2x, see _history_window)
+# OpenRouter providers that take explicit cache_control breakpoints; the
+# others (OpenAI, DeepSeek, ...) cache stable prefixes automatically
+CACHE_CONTROL_PREFIXES = ('anthropic/', 'google/')
+RESULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'thelp', 'openai')
+RESULT_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+VISION_MAX_SIZE = (1568, 1568)  # vision models downscale anything larger anyway
+VISION_DETAIL = 'low'  # OpenAI vision models bill a low-detail image at a fraction of the tokens
+# Connection pool sized for sustained concurrency; idle connections are kept
+# for two minutes so bursts reuse the TLS session instead of handshaking again
+HTTP_LIMITS = httpx.Limits(max_connections=256, max_keepalive_connections=128, keepalive_expiry=120.0)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+MODEL_LIST_TTL = 300  # seconds between refreshes of OpenRouter's model list
+
+
+# Telkom-specific system prompt
+SYSTEM_PROMPT = """You are T-Help, an expert Telkom technical support assistant. Your role is to help customers troubleshoot technical issues with their Telkom services including:
+
+- Internet connectivity problems
+- Wi-Fi and router issues  
+- Mobile network problems
+- ADSL/Fiber connection issues
+- Email setup and configuration
+- Device configuration
+- Network speed and performance issues
+- Billing and account-related technical queries
+
+IMPORTANT GUIDELINES:
+1. Always be helpful, patient, and professional
+2. Provide step-by-step troubleshooting instructions
+3. Ask clarifying questions when needed
+4. Escalate complex issues to human agents when appropriate
+5. Support multiple languages (English, Afrikaans, Zulu)
+6. Keep responses concise but comprehensive
+7. Always prioritize customer safety and data security
+
+When analyzing files/images:
+- Screenshots: Identify error messages and provide solutions
+- Network configs: Analyze settings and suggest corrections  
+- Bills/Documents: Help understand technical service details
+- Videos: Describe technical procedures shown
+
+Respond in the same language as the customer's query."""
+
+# Language detection patterns
+LANGUAGE_PATTERNS = {
+    'afrikaans': ['ek', 'jy', 'dis', 'nie', 'wat', 'hoe', 'waar', 'wanneer', 'hoekom', 'asseblief', 'dankie'],
+    'zulu': ['ngi', 'uku', 'ngi-', 'isi', 'aba', 'ama', 'sawubona', 'ngiyabonga', 'unjani', 'kunjani'],
+    'english': ['the', 'and', 'you', 'how', 'what', 'where', 'when', 'why', 'please', 'thank']
+}
+# One compiled regex per language, matching the patterns at word starts
+# (longest first so e.g. 'ngi-' wins over 'ngi')
+_LANGUAGE_RES = {
+    lang: re.compile(r'\b(' + '|'.join(map(re.escape, sorted(patterns, key=len, reverse=True))) + ')')
+    for lang, patterns in LANGUAGE_PATTERNS.items()
+}
+
+
+# Connections belong to the event loop that opened them, so there is one
+# shared client per loop (dropped along with the loop)
+_http_clients = weakref.WeakKeyDictionary()
+
+
+def _shared_http_client() -> httpx.AsyncClient:
+    """HTTP/2 client shared by every OpenAIIntegration on the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = openai.DefaultAsyncHttpxClient(http2=True, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+        _http_clients[loop] = client
+    return client
+
+
+async def close_http_client():
+    """Close the running loop's shared HTTP client; call on shutdown"""
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _load_encoding():
+    """gpt-4o tokenizer, a close enough count for every OpenRouter model we use"""
+    try:
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception as e:
+        # The BPE file is downloaded on first use; estimate from characters until it is available
+        logger.warning(f"tiktoken encoding unavailable, estimating tokens from characters: {e}")
+        return None
+
+
+# Request and token budgets per minute (OpenRouter's free tier allows 20 requests/minute)
+OPENROUTER_RPM = int(os.environ.get('OPENROUTER_RPM', 20))
+OPENROUTER_TPM = int(os.environ.get('OPENROUTER_TPM', 100000))
+MAX_RATE_LIMIT_RETRIES = 2  # once every fallback model is rate limited too
+MAX_TRANSPORT_RETRIES = 1  # connection errors and 5xx responses
+
+
+class _TokenBucket:
+    """
+    Per-minute budget refilled continuously. acquire() waits until enough
+    capacity is available, so bursts are spread out instead of hitting 429s.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0  # units per second
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        # Requests larger than the whole budget are allowed once the bucket is full
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def refund(self, amount: float = 1):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
 class OpenAIIntegration:
     """
     OpenAI Integration for T-Help Technical Support Chatbot
@@ -27,14 +168,16 @@ class OpenAIIntegration:
             raise ValueError("OpenRouter API key is required. Set OPENROUTER_API_KEY environment variable.")
         
         # --- MODIFIED: Initialize OpenAI client to point to OpenRouter's API endpoint ---
-        self.client = openai.OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=self.api_key,
-            default_headers={
+        self.client_options = {
+            'base_url': "https://openrouter.ai/api/v1",
+            'api_key': self.api_key,
+            'default_headers': {
                 "HTTP-Referer": os.environ.get('YOUR_SITE_URL', 'http://localhost:5000'),
                 "X-Title": os.environ.get('YOUR_SITE_NAME', 'T-Help Assistant'),
             }
-        )
+        }
+        # Async clients (see the client property), one per event loop
+        self._clients = weakref.WeakKeyDictionary()
         
         # --- MODIFIED: Model configurations updated for OpenRouter's free and compatible models ---
         self.models = {
@@ -43,27 +186,72 @@ class OpenAIIntegration:
             'cost_efficient': 'openai/gpt-oss-120b:free', # Use the main free model
             'fast': 'mistralai/mistral-7b-instruct:free',
             'vision': 'google/gemini-pro-vision',       # OpenRouter compatible vision model
-            'audio': 'openai/whisper-1'                 # OpenRouter supports Whisper
+            'audio': 'openai/whisper-1',                # OpenRouter supports Whisper
+            'embedding': 'openai/text-embedding-3-small'
         }
         
-        # Check API status on initialization
-        self.api_available = self._test_api_connection()
+        # Tokenizer for trimming prompts to the context budget
+        self._enc = _load_encoding()
         
-        # Telkom-specific system prompt
-        self.system_prompt = self._create_telkom_system_prompt()
+        # Chat completions are paced by per-minute request and token budgets
+        self._rpm_bucket = _TokenBucket(OPENROUTER_RPM)
+        self._tpm_bucket = _TokenBucket(OPENROUTER_TPM)
         
-        # Language detection patterns
-        self.language_patterns = {
-            'afrikaans': ['ek', 'jy', 'dis', 'nie', 'wat', 'hoe', 'waar', 'wanneer', 'hoekom', 'asseblief', 'dankie'],
-            'zulu': ['ngi', 'uku', 'ngi-', 'isi', 'aba', 'ama', 'sawubona', 'ngiyabonga', 'unjani', 'kunjani'],
-            'english': ['the', 'and', 'you', 'how', 'what', 'where', 'when', 'why', 'please', 'thank']
-        }
+        # Exact + semantic cache of text replies; embeddings use a small sync
+        # client because cache lookups run in a worker thread
+        self._embedding_client = openai.OpenAI(**self.client_options)
+        self.response_cache = ResponseCache(self._embed_text, threshold=0.95)
+        # Transcripts and image analyses keyed by file content, so re-sent
+        # voice notes and screenshots skip the API entirely
+        self.result_cache = diskcache.Cache(RESULT_CACHE_DIR)
+        
+        # API status is probed on first use rather than blocking startup
+        self.api_available = None
+        self._probe_locks = weakref.WeakKeyDictionary()  # event loop -> asyncio.Lock
+        
+        # (monotonic time, set of model ids) from the last models.list() call
+        self._model_list = None
+        
+        # Telkom-specific system prompt and language detection patterns (shared by all instances)
+        self.system_prompt = SYSTEM_PROMPT
+        self.language_patterns = LANGUAGE_PATTERNS
+        self._language_res = _LANGUAGE_RES
+
+    @property
+    def client(self) -> openai.AsyncOpenAI:
+        """
+        Async client for the running event loop, so concurrent requests don't
+        block it. Its HTTP/2 connection pool is shared by every instance on the
+        loop, so requests are multiplexed over warm connections to OpenRouter
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed():
+            client = openai.AsyncOpenAI(
+                **self.client_options,
+                timeout=HTTP_TIMEOUT,
+                # _make_api_call is the only retry layer, so every attempt is paced
+                max_retries=0,
+                http_client=_shared_http_client()
+            )
+            self._clients[loop] = client
+        return client
 
-    def _test_api_connection(self) -> bool:
+    async def _check_api_available(self) -> bool:
+        """Probe the API once, on first use, and remember the result"""
+        if self.api_available is None:
+            lock = self._probe_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+            async with lock:
+                # Concurrent first requests wait for a single probe
+                if self.api_available is None:
+                    self.api_available = await self._test_api_connection()
+        return self.api_available
+
+    async def _test_api_connection(self) -> bool:
         """Test API connection and quota"""
         try:
             # Make a minimal API call to test connection
-            response = self.client.chat.completions.create(
+            await self.client.chat.completions.create(
                 model=self.models['cost_efficient'],
                 messages=[{"role": "user", "content": "test"}],
                 max_tokens=1
@@ -78,35 +266,63 @@ class OpenAIIntegration:
                 logger.error("⏰ Rate limit exceeded - please wait and try again")
             return False
 
-    def _create_telkom_system_prompt(self) -> str:
-        """Create specialized system prompt for Telkom technical support"""
-        return """You are T-Help, an expert Telkom technical support assistant. Your role is to help customers troubleshoot technical issues with their Telkom services including:
+    def _system_message(self, model: str) -> Dict[str, Any]:
+        """
+        The system prompt, always sent first and byte-for-byte identical so
+        provider prompt caches can reuse it across requests
+        """
+        if model.startswith(CACHE_CONTROL_PREFIXES):
+            return {
+                "role": "system",
+                "content": [{"type": "text", "text": self.system_prompt, "cache_control": {"type": "ephemeral"}}]
+            }
+        return {"role": "system", "content": self.system_prompt}
 
-- Internet connectivity problems
-- Wi-Fi and router issues  
-- Mobile network problems
-- ADSL/Fiber connection issues
-- Email setup and configuration
-- Device configuration
-- Network speed and performance issues
-- Billing and account-related technical queries
+    @staticmethod
+    def _history_window(history: List[Dict]) -> List[Dict]:
+        """
+        Recent history to send. Instead of sliding by one message per turn
+        (which changes the prompt right after the system message every time),
+        the window start advances HISTORY_WINDOW messages at a time, so
+        consecutive requests share a growing cached prefix.
+        """
+        if len(history) <= HISTORY_WINDOW:
+            return history
+        start = (len(history) - HISTORY_WINDOW) // HISTORY_WINDOW * HISTORY_WINDOW
+        return history[start:]
 
-IMPORTANT GUIDELINES:
-1. Always be helpful, patient, and professional
-2. Provide step-by-step troubleshooting instructions
-3. Ask clarifying questions when needed
-4. Escalate complex issues to human agents when appropriate
-5. Support multiple languages (English, Afrikaans, Zulu)
-6. Keep responses concise but comprehensive
-7. Always prioritize customer safety and data security
+    def _count_tokens(self, text: str) -> int:
+        if self._enc is None:
+            return len(text) // 4
+        return len(self._enc.encode(text, disallowed_special=()))
 
-When analyzing files/images:
-- Screenshots: Identify error messages and provide solutions
-- Network configs: Analyze settings and suggest corrections  
-- Bills/Documents: Help understand technical service details
-- Videos: Describe technical procedures shown
+    def _trim_to_tokens(self, text: str, n: int) -> str:
+        """Cut text to its first n tokens"""
+        if self._enc is None:
+            return text[:n * 4]
+        tokens = self._enc.encode(text, disallowed_special=())
+        return text if len(tokens) <= n else self._enc.decode(tokens[:n])
 
-Respond in the same language as the customer's query."""
+    def _fit_history(self, history: List[Dict], message: str, max_tokens: int) -> List[Dict]:
+        """
+        Recent history (see _history_window), dropping the oldest messages
+        until the prompt and the reply fit in CONTEXT_TOKENS
+        """
+        history = self._history_window(history)
+        budget = (
+            CONTEXT_TOKENS - max_tokens - TOKEN_SAFETY_MARGIN
+            - self._count_tokens(self.system_prompt) - self._count_tokens(message)
+        )
+        counts = [self._count_tokens(str(msg['content'])) for msg in history]
+        start = 0
+        while start < len(history) and sum(counts[start:]) > budget:
+            start += 1
+        return history[start:]
+
+    def _embed_text(self, text: str) -> List[float]:
+        """Embed text for semantic similarity lookups"""
+        response = self._embedding_client.embeddings.create(model=self.models['embedding'], input=text)
+        return response.data[0].embedding
 
     def detect_language(self, text: str) -> str:
         """Detect the primary language of the input text"""
@@ -116,9 +332,9 @@ Respond in the same language as the customer's query."""
         text_lower = text.lower()
         language_scores = {}
         
-        for lang, patterns in self.language_patterns.items():
-            score = sum(1 for pattern in patterns if pattern in text_lower)
-            language_scores[lang] = score
+        for lang, pattern_re in self._language_res.items():
+            # Score is the number of distinct patterns found, as before
+            language_scores[lang] = len(set(pattern_re.findall(text_lower)))
         
         detected_lang = max(language_scores, key=language_scores.get)
         return detected_lang if language_scores[detected_lang] > 0 else 'english'
@@ -135,7 +351,7 @@ Respond in the same language as the customer's query."""
         """
         try:
             # Check if API is available
-            if not self.api_available:
+            if not await self._check_api_available():
                 return self._create_quota_exceeded_response()
             
             # Detect language if not provided
@@ -146,13 +362,34 @@ Respond in the same language as the customer's query."""
             model_name = model or self.models['cost_efficient']  # Use cheapest first
             
             # Prepare conversation history
-            messages = [{"role": "system", "content": self.system_prompt}]
+            messages = [self._system_message(model_name)]
             
-            if conversation_history:
-                messages.extend(conversation_history[-6:])  # Keep last 6 messages for context (reduced)
+            recent_history = self._fit_history(conversation_history or [], message, max_tokens=500)
+            messages.extend(recent_history)
             
             messages.append({"role": "user", "content": message})
             
+            # Repeated questions are answered from the cache. Only the message is
+            # embedded; model and history are the context it must match exactly.
+            # Long conversations only use exact matches, as similar wording there
+            # rarely means the same thing
+            cache_context = '\n'.join(
+                [model_name] + [f"{msg['role']}: {msg['content']}" for msg in recent_history]
+            )
+            use_semantic = len(conversation_history or []) <= SEMANTIC_CACHE_MAX_HISTORY
+            cached_response, embedding = await asyncio.to_thread(
+                self.response_cache.lookup, message, cache_context, use_semantic
+            )
+            if cached_response:
+                return {
+                    'success': True,
+                    'response': cached_response,
+                    'model_used': 'cache',
+                    'detected_language': language,
+                    'usage': {},
+                    'timestamp': datetime.now().isoformat()
+                }
+            
             # Make API call
             response = await self._make_api_call(
                 model=model_name,
@@ -161,22 +398,61 @@ Respond in the same language as the customer's query."""
                 temperature=0.7
             )
             
+            response_text = response.choices[0].message.content
+            await asyncio.to_thread(self.response_cache.put, message, response_text, embedding, cache_context)
+            
             return {
                 'success': True,
-                'response': response['choices'][0]['message']['content'],
-                'model_used': model_name,
+                'response': response_text,
+                'model_used': response.model or model_name,  # whichever fallback answered
                 'detected_language': language,
-                'usage': response.get('usage', {}),
+                'usage': response.usage.model_dump(exclude_none=True) if response.usage else {},
                 'timestamp': datetime.now().isoformat()
             }
             
         except Exception as e:
             logger.error(f"Error processing text message: {str(e)}")
-            if "insufficient_quota" in str(e) or "429" in str(e):
+            # A plain rate limit (429) that outlasted the retries is temporary
+            if "insufficient_quota" in str(e):
                 self.api_available = False  # Mark API as unavailable
                 return self._create_quota_exceeded_response()
             return self._create_error_response(e)
 
+    async def process_text_message_stream(
+        self,
+        message: str,
+        conversation_history: List[Dict] = None,
+        model: str = None
+    ) -> AsyncIterator[str]:
+        """
+        Yield the reply to a text message as it is generated, so the first
+        words can be shown before the whole reply is ready. Streamed replies
+        skip the cache and the fallback models, and errors are raised to the caller.
+        """
+        if not await self._check_api_available():
+            raise Exception("OpenAI API quota exceeded or unavailable")
+        
+        model_name = model or self.models['cost_efficient']
+        messages = [self._system_message(model_name)]
+        messages.extend(self._fit_history(conversation_history or [], message, max_tokens=500))
+        messages.append({"role": "user", "content": message})
+        
+        await self._rpm_bucket.acquire()
+        await self._tpm_bucket.acquire(self._estimate_tokens(messages, 500))
+        stream = await self.client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            max_tokens=500,
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage:
+                logger.info(f"✅ Streamed reply from {model_name}: {chunk.usage.total_tokens} tokens")
+
     async def process_image_message(
         self, 
         image_path: str, 
@@ -189,8 +465,21 @@ Respond in the same language as the customer's query."""
         try:
             model_name = model or self.models['vision']
             
-            # Encode image to base64
-            base64_image = self._encode_image_to_base64(image_path)
+            digest = await asyncio.to_thread(self._hash_file, image_path)
+            cache_key = ('vision', digest, model_name, text_message)
+            cached_response = await asyncio.to_thread(self.result_cache.get, cache_key)
+            if cached_response is not None:
+                return {
+                    'success': True,
+                    'response': cached_response,
+                    'model_used': 'cache',
+                    'message_type': 'image_analysis',
+                    'usage': {},
+                    'timestamp': datetime.now().isoformat()
+                }
+            
+            # Encode image as a base64 data URL
+            image_url = await asyncio.to_thread(self._encode_image_data_url, image_path)
             
             # Prepare message content
             content = []
@@ -201,11 +490,11 @@ Respond in the same language as the customer's query."""
             
             content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                "image_url": {"url": image_url, "detail": VISION_DETAIL}
             })
             
             messages = [
-                {"role": "system", "content": self.system_prompt},
+                self._system_message(model_name),
                 {"role": "user", "content": content}
             ]
             
@@ -216,12 +505,15 @@ Respond in the same language as the customer's query."""
                 temperature=0.7
             )
             
+            response_text = response.choices[0].message.content
+            await asyncio.to_thread(self.result_cache.set, cache_key, response_text, expire=RESULT_CACHE_TTL)
+            
             return {
                 'success': True,
-                'response': response['choices'][0]['message']['content'],
+                'response': response_text,
                 'model_used': model_name,
                 'message_type': 'image_analysis',
-                'usage': response.get('usage', {}),
+                'usage': response.usage.model_dump(exclude_none=True) if response.usage else {},
                 'timestamp': datetime.now().isoformat()
             }
             
@@ -235,12 +527,17 @@ Respond in the same language as the customer's query."""
         """
         try:
             # Transcribe audio
-            with open(audio_path, "rb") as audio_file:
-                transcript = self.client.audio.transcriptions.create(
+            # Read the file off the event loop and upload it from memory
+            audio_data = await asyncio.to_thread(self._read_file, audio_path)
+            cache_key = ('whisper', blake3.blake3(audio_data).hexdigest(length=16))
+            transcript = await asyncio.to_thread(self.result_cache.get, cache_key)
+            if transcript is None:
+                transcript = await self.client.audio.transcriptions.create(
                     model=self.models['audio'],
-                    file=audio_file,
+                    file=(os.path.basename(audio_path), audio_data),
                     response_format="text"
                 )
+                await asyncio.to_thread(self.result_cache.set, cache_key, transcript, expire=RESULT_CACHE_TTL)
             
             # Process the transcribed text
             text_response = await self.process_text_message(transcript)
@@ -269,14 +566,14 @@ Respond in the same language as the customer's query."""
         """
         try:
             # Extract text from PDF
-            pdf_text = self._extract_pdf_text(pdf_path)
+            pdf_text = await asyncio.to_thread(self._extract_pdf_text, pdf_path, PDF_EXTRACT_CHARS)
             
             # Combine with user message
             combined_message = f"""
             User message: {text_message}
             
             PDF Content Summary:
-            {pdf_text[:2000]}  # Limit to first 2000 characters
+            {self._trim_to_tokens(pdf_text, PDF_PROMPT_TOKENS)}
             
             Please analyze this document and help with any Telkom technical issues mentioned.
             """
@@ -299,12 +596,12 @@ Respond in the same language as the customer's query."""
             logger.error(f"Error processing PDF: {str(e)}")
             return self._create_error_response(e)
 
-    async def _make_api_call(self, **kwargs) -> Dict[str, Any]:
+    async def _make_api_call(self, **kwargs) -> ChatCompletion:
         """
         Make API call with fallback models and better error handling
         """
         # If API is not available, skip trying
-        if not self.api_available:
+        if not await self._check_api_available():
             raise Exception("OpenAI API quota exceeded or unavailable")
         
         models_to_try = [
@@ -316,35 +613,51 @@ Respond in the same language as the customer's query."""
         if kwargs.get('model') == self.models['primary']:
             models_to_try = [self.models['primary']] + models_to_try
         
-        last_error = None
+        estimated_tokens = self._estimate_tokens(kwargs.get('messages', []), kwargs.get('max_tokens', 0))
+        # OpenRouter walks the models list server-side, so a failing model
+        # costs one request instead of a client-side round trip per model
+        kwargs['model'] = models_to_try[0]
+        kwargs['extra_body'] = {'models': list(dict.fromkeys(models_to_try)), 'route': 'fallback'}
+        rate_limit_attempts = transport_attempts = 0
         
-        for model in models_to_try:
+        while True:
+            await self._rpm_bucket.acquire()
+            await self._tpm_bucket.acquire(estimated_tokens)
             try:
-                kwargs['model'] = model
-                response = self.client.chat.completions.create(**kwargs)
-                logger.info(f"✅ Successfully used model: {model}")
-                return response.model_dump()
-            except Exception as e:
-                last_error = e
-                error_str = str(e)
-                logger.warning(f"❌ Model {model} failed: {error_str}")
-                
+                response = await self.client.chat.completions.create(**kwargs)
+                logger.info(f"✅ Successfully used model: {response.model}")
+                return response
+            except openai.RateLimitError as e:
                 # Check for quota/billing issues
-                if "insufficient_quota" in error_str or "429" in error_str:
+                if "insufficient_quota" in str(e):
                     self.api_available = False
                     logger.error("💳 OpenAI quota exceeded - switching to fallback mode")
                     raise e
-                
-                # If rate limited, wait a bit
-                if "rate_limit" in error_str.lower():
-                    logger.info("⏰ Rate limited - waiting 2 seconds...")
-                    await asyncio.sleep(2)
-                
-                if model == models_to_try[-1]:
+                # The request was rejected, so its tokens were not spent
+                self._tpm_bucket.refund(estimated_tokens)
+                if rate_limit_attempts == MAX_RATE_LIMIT_RETRIES:
                     raise e
-                continue
-        
-        raise last_error
+                rate_limit_attempts += 1
+                retry_after = self._retry_after(e)
+                logger.info(f"⏰ Rate limited - waiting {retry_after:.1f} seconds...")
+                await asyncio.sleep(retry_after)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                if transport_attempts == MAX_TRANSPORT_RETRIES:
+                    raise e
+                transport_attempts += 1
+                logger.warning(f"❌ OpenRouter request failed, retrying: {str(e)}")
+
+    def _estimate_tokens(self, messages: List[Dict], max_tokens: int) -> int:
+        """Token count of the prompt plus the reply limit, for the TPM budget"""
+        return sum(self._count_tokens(str(msg['content'])) for msg in messages) + max_tokens
+
+    @staticmethod
+    def _retry_after(error: openai.RateLimitError) -> float:
+        """Seconds to wait before retrying, from the Retry-After header (default 2)"""
+        try:
+            return max(0.0, float(error.response.headers.get('retry-after', 2)))
+        except (AttributeError, TypeError, ValueError):
+            return 2.0
 
     def _create_quota_exceeded_response(self) -> Dict[str, Any]:
         """Create response when OpenAI quota is exceeded"""
@@ -366,20 +679,45 @@ Would you like me to provide more specific troubleshooting steps?""",
             'timestamp': datetime.now().isoformat()
         }
 
-    def _encode_image_to_base64(self, image_path: str) -> str:
-        """Encode image to base64 string"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+    def _hash_file(self, path: str) -> str:
+        """128-bit BLAKE3 fingerprint of a file, hashed from a memory map"""
+        return blake3.blake3(max_threads=blake3.blake3.AUTO).update_mmap(path).hexdigest(length=16)
+
+    def _read_file(self, path: str) -> bytes:
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def _encode_image_data_url(self, image_path: str) -> str:
+        """Downscale an image, re-encode it as JPEG and return it as a base64 data URL"""
+        # Imported here so text-only workers never load PIL
+        from PIL import Image
+        with Image.open(image_path) as img:
+            img.thumbnail(VISION_MAX_SIZE, Image.LANCZOS)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            with BytesIO() as buffer:
+                img.save(buffer, format='JPEG', quality=85)
+                # Encode straight from the buffer's memory and append to the prefix
+                # in place, so the base64 text is decoded to a str only once
+                data_url = bytearray(b'data:image/jpeg;base64,')
+                data_url += base64.b64encode(buffer.getbuffer())
+                return data_url.decode('ascii')
 
-    def _extract_pdf_text(self, pdf_path: str) -> str:
-        """Extract text from PDF file"""
+    def _extract_pdf_text(self, pdf_path: str, max_chars: int = None) -> str:
+        """Extract text from PDF file, stopping once max_chars have been collected"""
         try:
             with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
+                pdf_reader = pypdf.PdfReader(file)
+                parts = []
+                total = 0
+                # Pages are parsed lazily, so the rest of a long document is never decoded
                 for page in pdf_reader.pages:
-                    text += page.extract_text()
-                return text
+                    text = page.extract_text() or ''
+                    parts.append(text)
+                    total += len(text)
+                    if max_chars is not None and total >= max_chars:
+                        break
+                return ''.join(parts)[:max_chars]
         except Exception as e:
             logger.error(f"Error extracting PDF text: {str(e)}")
             return "Could not extract text from PDF."
@@ -393,11 +731,13 @@ Would you like me to provide more specific troubleshooting steps?""",
             'timestamp': datetime.now().isoformat()
         }
 
-    def get_model_status(self) -> Dict[str, Any]:
-        """Check the status of available models"""
+    async def get_model_status(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """Check the status of available models (the model list is cached for MODEL_LIST_TTL seconds)"""
         try:
-            models = self.client.models.list()
-            available_models = [model.id for model in models.data]
+            if force_refresh or self._model_list is None or time.monotonic() - self._model_list[0] > MODEL_LIST_TTL:
+                models = await self.client.models.list()
+                self._model_list = (time.monotonic(), {model.id for model in models.data})
+            available_models = self._model_list[1]
             
             status = {}
             for category, model_name in self.models.items():
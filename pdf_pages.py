@@ -0,0 +1,39 @@
+import pypdfium2 as pdfium
+
+# Page-level PDFium text extraction. Kept free of other dependencies because
+# extract_page_range runs in spawned worker processes, which import only the
+# module a task's function lives in (plus the main module).
+
+
+def page_text(pdf, index: int) -> str:
+    """Text of a single page of an open PdfDocument"""
+    page = pdf[index]
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range()
+    finally:
+        textpage.close()
+        page.close()
+
+
+def join_page_text(page_texts, max_chars: int) -> str:
+    """Join page texts lazily, stopping once max_chars have been collected"""
+    parts = []
+    total = 0
+    for text in page_texts:
+        parts.append(text)
+        total += len(text)
+        if total >= max_chars:
+            break
+    return '\n'.join(parts)[:max_chars]
+
+
+def extract_page_range(args) -> str:
+    """Extract text from pages [start, stop) of a PDF in a worker process"""
+    # PDFium handles cannot cross process boundaries, so each worker reopens the file
+    pdf_path, start, stop, max_chars = args
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return join_page_text((page_text(pdf, i) for i in range(start, stop)), max_chars)
+    finally:
+        pdf.close()
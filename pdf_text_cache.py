@@ -0,0 +1,117 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PDF_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'thelp', 'pdf')
+PDF_CACHE_SIZE = 128                  # entries kept in memory
+PDF_CACHE_MAX_BYTES = 1024 ** 3       # disk tier limit (1 GiB)
+
+
+class PdfTextCache:
+    """
+    Two-tier cache of extracted PDF text keyed by a hash of the file contents.
+    A small in-memory LRU sits in front of a directory of text files, so the
+    same document uploaded again skips extraction even after a restart.
+    The disk tier evicts the least recently read files (by mtime) once it
+    grows past max_bytes; disk errors only cost a cache miss.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = PDF_CACHE_DIR,
+        max_entries: int = PDF_CACHE_SIZE,
+        max_bytes: int = PDF_CACHE_MAX_BYTES
+    ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()  # (digest, max_chars) -> text
+        self._disk_bytes = None       # measured on the first write
+        self._lock = threading.Lock()
+
+    def _path(self, digest: str, max_chars: int) -> str:
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}-{max_chars}.txt")
+
+    def get(self, digest: str, max_chars: int) -> Optional[str]:
+        key = (digest, max_chars)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        path = self._path(digest, max_chars)
+        try:
+            with open(path, encoding='utf-8') as file:
+                text = file.read()
+            os.utime(path)  # mark as recently used for eviction
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"PDF cache read failed: {e}")
+            return None
+
+        self._remember(key, text)
+        return text
+
+    def put(self, digest: str, max_chars: int, text: str):
+        self._remember((digest, max_chars), text)
+
+        path = self._path(digest, max_chars)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary name first so readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.write(text)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"PDF cache write failed: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_bytes += size
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _remember(self, key, text: str):
+        with self._lock:
+            self._memory[key] = text
+            self._memory.move_to_end(key)
+            if len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_entries(self):
+        """Yield (path, size, mtime) for every cached file"""
+        try:
+            subdirs = list(os.scandir(self.cache_dir))
+        except OSError:
+            return
+        for subdir in subdirs:
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith('.txt'):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """Delete the least recently used files until the disk tier is back under 90% of max_bytes"""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        self._disk_bytes = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if self._disk_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self._disk_bytes -= size
+            except OSError as e:
+                logger.warning(f"PDF cache eviction failed: {e}")
@@ -0,0 +1,187 @@
+import time
+import logging
+import blake3
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+REDIS_PREFIX = 'rcache'
+REDIS_ENTRY_TTL = 7 * 24 * 60 * 60  # seconds
+
+
+class ResponseCache:
+    """
+    Exact + semantic cache for AI text responses.
+    Exact matches on the normalized context + prompt are checked first; on a
+    miss the embedding of the prompt alone is compared by cosine similarity
+    against previous prompts asked in the same context (e.g. after the same
+    previous turn), so a shared context cannot make unrelated questions match.
+    With a Redis URL, entries are also persisted there so they survive restarts
+    and are shared between workers; any Redis error falls back to memory only.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[str], List[float]],
+        max_entries: int = 1000,
+        threshold: float = 0.93,
+        redis_url: Optional[str] = None
+    ):
+        self.embed_fn = embed_fn
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._exact = OrderedDict()     # normalized prompt -> response
+        self._semantic = OrderedDict()  # exact key -> (context id, embedding, response)
+        self._matrix = None             # stacked embeddings, rebuilt lazily
+        self._matrix_keys = []          # row order of self._matrix
+        self._matrix_contexts = None    # context id of each row
+        self._lock = threading.Lock()
+        self.redis = None
+        if redis_url:
+            import redis
+            self.redis = redis.Redis.from_url(redis_url)
+            self._load_from_redis()
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return ' '.join(text.lower().split())
+
+    @classmethod
+    def _key(cls, text: str, context: str) -> str:
+        return cls._normalize(f"{context}\n{text}" if context else text)
+
+    @classmethod
+    def _context_id(cls, context: str) -> str:
+        return blake3.blake3(cls._normalize(context).encode()).hexdigest(length=8)
+
+    @staticmethod
+    def _redis_key(key: str) -> str:
+        return f"{REDIS_PREFIX}:{blake3.blake3(key.encode()).hexdigest(length=8)}"
+
+    def _load_from_redis(self):
+        """Warm the in-memory tiers with the most recent persisted entries"""
+        try:
+            entry_keys = self.redis.zrange(f"{REDIS_PREFIX}:index", -self.max_entries, -1)
+            pipe = self.redis.pipeline()
+            for entry_key in entry_keys:
+                pipe.hgetall(entry_key)
+            entries = pipe.execute()
+        except Exception as e:
+            logger.warning(f"Response cache Redis load failed: {e}")
+            return
+
+        for entry in entries:
+            if not entry:
+                continue
+            key = entry[b'prompt'].decode()
+            response = entry[b'response'].decode()
+            self._exact[key] = response
+            if entry.get(b'embedding') and entry.get(b'context'):
+                embedding = np.frombuffer(entry[b'embedding'], dtype=np.float32)
+                self._semantic[key] = (entry[b'context'].decode(), embedding, response)
+
+    def _redis_get(self, key: str) -> Optional[str]:
+        if not self.redis:
+            return None
+        try:
+            response = self.redis.hget(self._redis_key(key), 'response')
+        except Exception as e:
+            logger.warning(f"Response cache Redis lookup failed: {e}")
+            return None
+        return response.decode() if response else None
+
+    def _redis_put(self, key: str, response: str, context_id: str, embedding: Optional[np.ndarray]):
+        if not self.redis:
+            return
+        entry_key = self._redis_key(key)
+        entry = {'prompt': key, 'response': response, 'ts': time.time()}
+        if embedding is not None:
+            entry['context'] = context_id
+            entry['embedding'] = embedding.astype(np.float32).tobytes()
+        try:
+            pipe = self.redis.pipeline()
+            pipe.hset(entry_key, mapping=entry)
+            pipe.expire(entry_key, REDIS_ENTRY_TTL)
+            pipe.zadd(f"{REDIS_PREFIX}:index", {entry_key: entry['ts']})
+            pipe.zremrangebyrank(f"{REDIS_PREFIX}:index", 0, -self.max_entries - 1)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Response cache Redis store failed: {e}")
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed and L2-normalize text, returning None if embedding fails"""
+        try:
+            vector = np.asarray(self.embed_fn(text), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Embedding Error: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, text: str, context: str = '', semantic: bool = True) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Return (cached_response, embedding). The embedding is handed back so
+        a following put() does not have to embed the same prompt twice.
+        With semantic=False only exact matches are considered.
+        """
+        key = self._key(text, context)
+        with self._lock:
+            if key in self._exact:
+                self._exact.move_to_end(key)
+                return self._exact[key], None
+
+        # Another worker may already have answered this exact prompt
+        response = self._redis_get(key)
+        if response:
+            with self._lock:
+                self._store_exact(key, response)
+            return response, None
+
+        if not semantic:
+            return None, None
+
+        embedding = self._embed(self._normalize(text))
+        if embedding is None:
+            return None, None
+
+        context_id = self._context_id(context)
+        with self._lock:
+            if not self._semantic:
+                return None, embedding
+            if self._matrix is None:
+                self._matrix_keys = list(self._semantic)
+                self._matrix_contexts = np.array([ctx for ctx, _, _ in self._semantic.values()])
+                self._matrix = np.stack([emb for _, emb, _ in self._semantic.values()])
+            scores = np.where(self._matrix_contexts == context_id, self._matrix @ embedding, -1.0)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None, embedding
+            best_key = self._matrix_keys[best]
+            self._semantic.move_to_end(best_key)
+            return self._semantic[best_key][2], embedding
+
+    def _store_exact(self, key: str, response: str):
+        """Insert into the exact tier, evicting the least recently used entry; caller holds the lock"""
+        self._exact[key] = response
+        self._exact.move_to_end(key)
+        if len(self._exact) > self.max_entries:
+            self._exact.popitem(last=False)
+
+    def put(self, text: str, response: str, embedding: Optional[np.ndarray] = None, context: str = ''):
+        """Store a response, evicting the least recently used entries"""
+        key = self._key(text, context)
+        context_id = self._context_id(context)
+        with self._lock:
+            self._store_exact(key, response)
+
+            if embedding is not None:
+                self._semantic[key] = (context_id, embedding, response)
+                self._semantic.move_to_end(key)
+                if len(self._semantic) > self.max_entries:
+                    self._semantic.popitem(last=False)
+                self._matrix = None
+
+        self._redis_put(key, response, context_id, embedding)
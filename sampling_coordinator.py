@@ -0,0 +1,131 @@
+import asyncio
+import orjson
+import logging
+from typing import Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 8
+WINDOW = 0.02  # seconds to wait for more requests once the first arrives
+
+BATCH_INSTRUCTION = (
+    "Answer each of the following independent customer messages. Every item has an id, "
+    "the recent conversation history for that customer and their new message. "
+    "Return only a JSON array with one object per item of the form "
+    '{"id": <id>, "response": "<your reply>"}.'
+)
+
+
+class SamplingCoordinator:
+    """
+    Coalesces text prompts that arrive within a short window into a single
+    Gemini call returning a JSON array, then hands each caller its own answer.
+    A window holding a single prompt is sent as a normal chat turn, and
+    callers submitting a prompt identical to one still in flight (same message
+    and history) share its future instead of queueing a duplicate.
+    """
+
+    def __init__(
+        self,
+        model,
+        send_single: Callable[[str, List[Dict]], Awaitable[str]],
+        max_batch: int = MAX_BATCH,
+        window: float = WINDOW
+    ):
+        self.model = model
+        self.send_single = send_single
+        self.max_batch = max_batch
+        self.window = window
+        self._queue = None
+        self._worker = None
+        self._dispatches = set()  # keep references so tasks are not collected
+        self._inflight = {}       # prompt key -> future of the pending request
+
+    async def submit(self, message: str, conversation_history: List[Dict]) -> str:
+        """Queue a prompt and wait for its response text"""
+        key = self._prompt_key(message, conversation_history)
+        future = self._inflight.get(key)
+        if future is None:
+            if self._worker is None or self._worker.done():
+                self._queue = asyncio.Queue()
+                self._worker = asyncio.create_task(self._run())
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            await self._queue.put((message, conversation_history, future))
+        # Shield so one caller being cancelled does not cancel the shared request
+        return await asyncio.shield(future)
+
+    @staticmethod
+    def _prompt_key(message: str, conversation_history: List[Dict]):
+        # Messages may also be lists of parts, which are not hashable
+        if isinstance(message, list):
+            message = tuple(message)
+        return (message, tuple(
+            (msg['type'], msg.get('text_content') or msg.get('content', ''))
+            for msg in conversation_history
+        ))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch):
+        if len(batch) == 1:
+            await self._resolve_single(*batch[0])
+            return
+
+        items = [
+            {
+                'id': i,
+                'history': [
+                    {'role': msg['type'], 'text': msg.get('text_content') or msg.get('content', '')}
+                    for msg in history
+                ],
+                'message': message
+            }
+            for i, (message, history, _) in enumerate(batch)
+        ]
+        responses = {}
+        try:
+            result = await self.model.generate_content_async(
+                [BATCH_INSTRUCTION, orjson.dumps(items).decode()],
+                generation_config={'response_mime_type': 'application/json'}
+            )
+            for entry in orjson.loads(result.text):
+                responses[entry['id']] = entry['response']
+        except Exception as e:
+            logger.warning(f"Batched Gemini call failed, sending individually: {e}")
+
+        # Anything the batch did not answer falls back to its own request
+        pending = []
+        for i, (message, history, future) in enumerate(batch):
+            if i in responses:
+                if not future.done():
+                    future.set_result(responses[i])
+            else:
+                pending.append(self._resolve_single(message, history, future))
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def _resolve_single(self, message, history, future):
+        try:
+            response_text = await self.send_single(message, history)
+            if not future.done():
+                future.set_result(response_text)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
@@ -0,0 +1,172 @@
+import os
+import json
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Dict, List, Tuple
+
+MAX_SESSIONS = 5000
+MAX_SESSION_MESSAGES = 200
+SESSION_TTL = 24 * 60 * 60  # seconds
+
+
+class SessionStore:
+    """
+    In-memory chat storage bounded in both directions: least recently used
+    sessions are evicted past MAX_SESSIONS and each session is a deque that
+    keeps only its last MAX_SESSION_MESSAGES messages.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, max_messages: int = MAX_SESSION_MESSAGES):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()  # session id -> deque of messages
+        self._message_seq = {}          # session id -> last message id handed out
+        self._memos = {}                # session id -> (memo, id of last folded message)
+        self._lock = threading.Lock()
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def __getitem__(self, session_id: str) -> List[Dict]:
+        with self._lock:
+            self._sessions.move_to_end(session_id)
+            return list(self._sessions[session_id])
+
+    def __setitem__(self, session_id: str, messages: List[Dict]):
+        with self._lock:
+            self._sessions[session_id] = deque(messages, maxlen=self.max_messages)
+            self._sessions.move_to_end(session_id)
+            self._message_seq.setdefault(session_id, len(messages))
+            while len(self._sessions) > self.max_sessions:
+                evicted, _ = self._sessions.popitem(last=False)
+                self._message_seq.pop(evicted, None)
+                self._memos.pop(evicted, None)
+
+    def get(self, session_id: str, default=None) -> List[Dict]:
+        with self._lock:
+            if session_id not in self._sessions:
+                return default
+            self._sessions.move_to_end(session_id)
+            return list(self._sessions[session_id])
+
+    def recent(self, session_id: str, count: int) -> List[Dict]:
+        """Return the last `count` messages of a session"""
+        with self._lock:
+            messages = self._sessions.get(session_id)
+            if not messages:
+                return []
+            self._sessions.move_to_end(session_id)
+            return list(islice(messages, max(0, len(messages) - count), None))
+
+    def next_message_id(self, session_id: str) -> int:
+        """Monotonic message id, unaffected by old messages being dropped"""
+        with self._lock:
+            message_id = self._message_seq.get(session_id, 0) + 1
+            # Evicted sessions get no new entry, so the counters stay bounded too
+            if session_id in self._sessions:
+                self._message_seq[session_id] = message_id
+            return message_id
+
+    def append(self, session_id: str, message: Dict):
+        """Append a message; the deque drops the oldest one once full"""
+        with self._lock:
+            messages = self._sessions.get(session_id)
+            if messages is not None:
+                messages.append(message)
+                self._sessions.move_to_end(session_id)
+
+    def get_memo(self, session_id: str) -> Tuple[str, int]:
+        """Return (memo, id of the last message folded into it)"""
+        with self._lock:
+            return self._memos.get(session_id, ('', 0))
+
+    def set_memo(self, session_id: str, memo: str, upto: int):
+        with self._lock:
+            if session_id in self._sessions:
+                self._memos[session_id] = (memo, upto)
+
+
+class RedisSessionStore:
+    """
+    Redis-backed chat storage shared by every worker process. Each session
+    is a list of JSON messages under sess:<id> that expires after SESSION_TTL.
+    """
+
+    def __init__(self, url: str, max_messages: int = MAX_SESSION_MESSAGES, ttl: int = SESSION_TTL):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.max_messages = max_messages
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"sess:{session_id}"
+
+    def __contains__(self, session_id: str) -> bool:
+        return bool(self.redis.exists(self._key(session_id)))
+
+    def __getitem__(self, session_id: str) -> List[Dict]:
+        messages = self.redis.lrange(self._key(session_id), 0, -1)
+        if not messages:
+            raise KeyError(session_id)
+        return [json.loads(msg) for msg in messages]
+
+    def __setitem__(self, session_id: str, messages: List[Dict]):
+        key = self._key(session_id)
+        pipe = self.redis.pipeline()
+        pipe.delete(key)
+        if messages:
+            pipe.rpush(key, *[json.dumps(msg) for msg in messages[-self.max_messages:]])
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def get(self, session_id: str, default=None) -> List[Dict]:
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def recent(self, session_id: str, count: int) -> List[Dict]:
+        """Return the last `count` messages of a session"""
+        return [json.loads(msg) for msg in self.redis.lrange(self._key(session_id), -count, -1)]
+
+    def next_message_id(self, session_id: str) -> int:
+        """Monotonic message id, unaffected by old messages being trimmed"""
+        key = f"{self._key(session_id)}:seq"
+        pipe = self.redis.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, self.ttl)
+        return pipe.execute()[0]
+
+    def append(self, session_id: str, message: Dict):
+        """Append a message, trimming the session to its newest messages"""
+        key = self._key(session_id)
+        pipe = self.redis.pipeline()
+        pipe.rpush(key, json.dumps(message))
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def get_memo(self, session_id: str) -> Tuple[str, int]:
+        """Return (memo, id of the last message folded into it)"""
+        memo = self.redis.hgetall(f"{self._key(session_id)}:memo")
+        if not memo:
+            return '', 0
+        return memo['memo'], int(memo['upto'])
+
+    def set_memo(self, session_id: str, memo: str, upto: int):
+        key = f"{self._key(session_id)}:memo"
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={'memo': memo, 'upto': upto})
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+
+def create_session_store():
+    """Use Redis when REDIS_URL is set, otherwise keep sessions in process memory"""
+    redis_url = os.environ.get('REDIS_URL')
+    if redis_url:
+        return RedisSessionStore(redis_url)
+    return SessionStore()